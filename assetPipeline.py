@@ -0,0 +1,105 @@
+import os
+import mmap
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # Reflinks are only attempted where the FICLONE ioctl exists
+    fcntl = None
+
+COPY_MODES = ('copy', 'hardlink', 'reflink')
+# ioctl request cloning a whole file on copy-on-write filesystems (btrfs, xfs, ...)
+FICLONE = 0x40049409
+CONVERTSM_MARKER = b'<convertsm>'
+
+def contains_marker(file_path, marker=CONVERTSM_MARKER):
+    """Checks whether a file contains marker, through a memory map instead of reading it into memory."""
+    with open(file_path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped.find(marker) != -1
+        except ValueError:
+            # Empty files cannot be mapped
+            return False
+
+def is_up_to_date(source, destination):
+    """Checks whether destination is already a copy of source, going by size and mtime."""
+    try:
+        destination_stat = os.stat(destination)
+    except FileNotFoundError:
+        return False
+    source_stat = os.stat(source)
+    if os.path.samestat(source_stat, destination_stat):
+        return True
+    return source_stat.st_size == destination_stat.st_size and source_stat.st_mtime_ns == destination_stat.st_mtime_ns
+
+def copy_contents(source, destination):
+    """Copies file contents in the kernel with copy_file_range where available."""
+    if not hasattr(os, 'copy_file_range'):
+        shutil.copyfile(source, destination)
+        return
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+                pass
+        except OSError:
+            # Not supported between these filesystems
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+            shutil.copyfileobj(src, dst)
+
+def reflink(source, destination):
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def copy_asset(source, destination, mode='copy'):
+    """Copies a file unless destination is already up to date, returning whether it copied.
+
+    `hardlink` links the destination to the source and `reflink` clones it on copy-on-write
+    filesystems; both fall back to a plain copy where the filesystem refuses. A hardlinked
+    output shares its storage with the input, so it must never be edited in place.
+    """
+    if is_up_to_date(source, destination):
+        return False
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if mode == 'hardlink':
+        try:
+            os.link(source, destination)
+            return True
+        except OSError:
+            pass
+    elif mode == 'reflink':
+        try:
+            reflink(source, destination)
+            shutil.copystat(source, destination)
+            return True
+        except OSError:
+            if os.path.lexists(destination):
+                os.remove(destination)
+    copy_contents(source, destination)
+    shutil.copystat(source, destination)
+    return True
+
+def copy_assets(pairs, mode='copy', max_workers=None):
+    """Copies (source, destination) pairs on a thread pool.
+
+    Returns the number of files copied, the number skipped as up to date and the bytes copied.
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return 0, 0, 0
+
+    def copy(pair):
+        source, destination = pair
+        return os.path.getsize(source) if copy_asset(source, destination, mode) else None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(copy, pairs))
+    copied = [size for size in results if size is not None]
+    return len(copied), len(results) - len(copied), sum(copied)
@@ -0,0 +1,90 @@
+"""Build times and peak memory of render.py on synthetic sites of increasing size.
+
+    python3 benchmarks/bench_build.py [--posts 100,1000,10000] [-j JOBS] [--json results.json]
+
+For every site size this times, each in a fresh process:
+
+- full: a cold build into an empty output directory, with empty caches
+- noop: an incremental rebuild with nothing changed
+- edit: an incremental rebuild after editing a single post
+- sitemap: generateSitemap.py over the built output
+- rss: generateRSS.py over the built output
+
+and records the peak resident memory of each run. Sites are generated with a fixed seed,
+so results can be compared release over release with --json.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_site import generate_site
+
+def run(command):
+    """Runs a command and returns its wall time in seconds and its peak RSS in megabytes."""
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=REPO_ROOT, stdout=subprocess.DEVNULL)
+    # wait4 reports the resources of this child alone, unlike RUSAGE_CHILDREN
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return elapsed, peak_mb
+
+def bench_site(work_dir, posts, jobs):
+    input_dir = os.path.join(work_dir, f'site-{posts}')
+    output_dir = os.path.join(work_dir, f'out-{posts}')
+    cache_dir = os.path.join(work_dir, f'cache-{posts}')
+    for path in (input_dir, output_dir, cache_dir):
+        shutil.rmtree(path, ignore_errors=True)
+    post_paths = generate_site(input_dir, posts)
+
+    render = [sys.executable, 'render.py', '-i', input_dir, '-o', output_dir, '--root', 'https://example.com',
+              '--title', 'Bench', '--incremental', '--cache-dir', cache_dir, '-j', str(jobs)]
+    results = {}
+    results['full'] = run(render)
+    results['noop'] = run(render)
+    with open(post_paths[len(post_paths) // 2], 'a', encoding='utf-8') as f:
+        f.write('\nAn edited paragraph.\n')
+    results['edit'] = run(render)
+    results['sitemap'] = run([sys.executable, 'generateSitemap.py', output_dir, '--urlroot', 'https://example.com'])
+    results['rss'] = run([sys.executable, 'generateRSS.py', output_dir, '--urlroot', 'https://example.com'])
+    return {scenario: {'seconds': seconds, 'peak_mb': peak_mb} for scenario, (seconds, peak_mb) in results.items()}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark full, no-op and single edit builds on synthetic sites.')
+    parser.add_argument('--posts', default='100,1000', help='Comma-separated site sizes in posts (e.g. 100,1000,10000,50000)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Jobs passed to render.py, 0 uses every core')
+    parser.add_argument('--work-dir', default=None, help='Directory for generated sites and outputs (default: a temporary directory)')
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.posts.split(',')]
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='simplymarkdown-bench-')
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(), 'jobs': args.jobs, 'sites': {}}
+    print(f"{'posts':>8}  {'scenario':<10}{'seconds':>10}{'peak MB':>10}")
+    try:
+        for posts in sizes:
+            report['sites'][posts] = bench_site(work_dir, posts, args.jobs)
+            for scenario, result in report['sites'][posts].items():
+                print(f"{posts:>8}  {scenario:<10}{result['seconds']:>10.3f}{result['peak_mb']:>10.1f}")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,49 @@
+"""Per-page cost of markdown conversion with a fresh converter per call versus the converter pool.
+
+    python3 benchmarks/bench_convert.py [-n ITERATIONS] [files...]
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown
+from helpers import convert_to_html, markdown_extensions, read_file_content
+
+EXAMPLE_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'example', 'input')
+
+def convert_with_fresh_converter(content, base_path=''):
+    """What convert_to_html did before converters were pooled."""
+    md = markdown.Markdown(extensions=markdown_extensions(base_path))
+    return md.convert(content), md.Meta
+
+def time_per_page(convert, pages, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for content, base_path in pages:
+            convert(content, base_path)
+    return (time.perf_counter() - start) / (iterations * len(pages))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark markdown conversion per page.')
+    parser.add_argument('files', nargs='*', help='Markdown files to convert (default: example/input)')
+    parser.add_argument('-n', '--iterations', type=int, default=50, help='Number of passes over the files')
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(EXAMPLE_INPUT, '**', '*.md'), recursive=True))
+    pages = [(read_file_content(file), os.path.dirname(file)) for file in files]
+
+    # Warm imports and the pool before timing
+    convert_with_fresh_converter(*pages[0])
+    convert_to_html(*pages[0])
+
+    fresh = time_per_page(convert_with_fresh_converter, pages, args.iterations)
+    pooled = time_per_page(convert_to_html, pages, args.iterations)
+
+    print(f'{len(pages)} pages x {args.iterations} iterations')
+    print(f'{"fresh converter":<18}{fresh * 1000:>10.3f} ms/page')
+    print(f'{"pooled converter":<18}{pooled * 1000:>10.3f} ms/page')
+    print(f'{"speedup":<18}{fresh / pooled:>10.2f}x')
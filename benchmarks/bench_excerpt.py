@@ -0,0 +1,81 @@
+"""Cost of extracting a preview excerpt from long posts, before and after the single-pass extractor.
+
+    python3 benchmarks/bench_excerpt.py [-n ITERATIONS] [--paragraphs N] [--limit LIMIT]
+
+Both extractors run with an identity processor, so only reading the post and preparing
+the excerpt is timed, not its markdown conversion.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from markdownTags import read_excerpt_components, prepare_excerpt, finish_excerpt_html
+from synthetic_site import paragraph
+
+def extract_excerpt_before(file_path, directory_name, relpath, preview_limit):
+    """What load_content_item did before the single-pass extractor."""
+    with open(file_path, 'r') as md_file:
+        content = md_file.read().strip()
+        content = content.replace('[TOC]', '')
+        components = content.split('\n\n')
+        components = [component for component in components if '<parsers-ignore>' not in component]
+        truncated = preview_limit < len(components)
+        components = components[:preview_limit]
+        content = '\n\n'.join(components) + '\n\n'
+        content = re.sub(r'\n@ [^\n]*', '', content, re.MULTILINE)
+        content = re.sub(r'\n! [^\n]*', '', content, re.MULTILINE)
+        content = re.sub(r'\n% [^\n]*', '', content, re.MULTILINE)
+        content = re.sub(r'(\[.*?\]\()\.', r'\1 ' + directory_name + '/' + relpath + '/.', content)
+        content = re.sub(r'<a\b[^>]*>(.*?)</a>', r'\1', content)
+        content = re.sub(r'<h[2-4]\b[^>]*>(.*?)</h[2-4]>', r'<b>\1</b>', content)
+        content = re.sub(r'<h1\b[^>]*>(.*?)</h1>', r'<div class="preview-title"><h2>\1</h2></div>', content)
+    return content, truncated
+
+def extract_excerpt_after(file_path, directory_name, relpath, preview_limit):
+    components, truncated = read_excerpt_components(file_path, preview_limit)
+    return finish_excerpt_html(prepare_excerpt(components, directory_name, relpath)), truncated
+
+def write_post(file_path, paragraphs, rng):
+    blocks = ['---\nemoji: 🐍\ndate: 2024-01-01\ntags: python\n---', '# A long post', '[TOC]']
+    for i in range(paragraphs):
+        blocks.append(paragraph(rng) + ' [a link](./image.png)')
+        if i % 10 == 0:
+            blocks.append('@ python\n! include snippet')
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(blocks) + '\n')
+
+def time_per_post(extract, files, iterations, preview_limit):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for file_path in files:
+            extract(file_path, 'posts', '2024', preview_limit)
+    return (time.perf_counter() - start) / (iterations * len(files))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark preview excerpt extraction on long posts.')
+    parser.add_argument('-n', '--iterations', type=int, default=20, help='Number of passes over the posts')
+    parser.add_argument('--paragraphs', type=int, default=2000, help='Paragraphs per generated post')
+    parser.add_argument('--limit', type=int, default=6, help='Preview limit, in blocks')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory(prefix='simplymarkdown-excerpt-') as work_dir:
+        files = [os.path.join(work_dir, f'post {i}.md') for i in range(10)]
+        for file_path in files:
+            write_post(file_path, args.paragraphs, rng)
+        size = os.path.getsize(files[0])
+
+        before = time_per_post(extract_excerpt_before, files, args.iterations, args.limit)
+        after = time_per_post(extract_excerpt_after, files, args.iterations, args.limit)
+
+    print(f'{len(files)} posts of {size / 1024:.0f} KiB x {args.iterations} iterations, preview limit {args.limit}')
+    print(f'{"before":<18}{before * 1000:>10.3f} ms/post')
+    print(f'{"single pass":<18}{after * 1000:>10.3f} ms/post')
+    print(f'{"speedup":<18}{before / after:>10.2f}x')
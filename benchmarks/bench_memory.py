@@ -0,0 +1,74 @@
+"""Peak memory of render.py as synthetic sites grow, with the growth per thousand posts.
+
+    python3 benchmarks/bench_memory.py [--posts 1000,4000,16000] [--page-size 20] [-j JOBS]
+
+For every site size this measures, each in a fresh process, the peak resident memory of:
+
+- full: a cold build into an empty output directory
+- sitemap: generateSitemap.py over the built output
+- rss: generateRSS.py over the built output
+- search: searchIndex.py over the built output
+
+then reports how many megabytes each grows by per thousand posts between the smallest
+and the largest site. Some growth is inherent: an unpaginated `% posts:detailed` page
+holds every post of the site, so listings are paginated with --page-size (0 leaves them
+unpaginated), the search index keeps the terms of every page until it is written, and
+render.py keeps a record and a work item per page and static file until its pages are
+rendered, see render.process_directory(). Only what is measured here is claimed: growth
+on paginated synthetic sites, not a bound for every site.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_site import generate_site
+from bench_build import run
+
+def bench_site(work_dir, posts, page_size, jobs):
+    input_dir = os.path.join(work_dir, f'site-{posts}')
+    output_dir = os.path.join(work_dir, f'out-{posts}')
+    cache_dir = os.path.join(work_dir, f'cache-{posts}')
+    for path in (input_dir, output_dir, cache_dir):
+        shutil.rmtree(path, ignore_errors=True)
+    generate_site(input_dir, posts, page_size=page_size or None)
+
+    results = {}
+    _, results['full'] = run([sys.executable, 'render.py', '-i', input_dir, '-o', output_dir, '--root', 'https://example.com',
+                              '--title', 'Bench', '--cache-dir', cache_dir, '-j', str(jobs)])
+    _, results['sitemap'] = run([sys.executable, 'generateSitemap.py', output_dir, '--urlroot', 'https://example.com'])
+    _, results['rss'] = run([sys.executable, 'generateRSS.py', output_dir, '--urlroot', 'https://example.com'])
+    _, results['search'] = run([sys.executable, 'searchIndex.py', output_dir, '--urlroot', 'https://example.com'])
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the peak memory of builds on synthetic sites of increasing size.')
+    parser.add_argument('--posts', default='1000,4000', help='Comma-separated site sizes in posts (e.g. 1000,4000,16000)')
+    parser.add_argument('--page-size', type=int, default=20, help='Posts per page of the listings, 0 leaves them unpaginated')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Jobs passed to render.py, 0 uses every core')
+    parser.add_argument('--work-dir', default=None, help='Directory for generated sites and outputs (default: a temporary directory)')
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.posts.split(','))
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='simplymarkdown-bench-')
+
+    peaks = {}
+    print(f"{'posts':>8}  {'scenario':<10}{'peak MB':>10}")
+    try:
+        for posts in sizes:
+            peaks[posts] = bench_site(work_dir, posts, args.page_size, args.jobs)
+            for scenario, peak_mb in peaks[posts].items():
+                print(f"{posts:>8}  {scenario:<10}{peak_mb:>10.1f}")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if len(sizes) > 1:
+        smallest, largest = sizes[0], sizes[-1]
+        print(f'\nGrowth from {smallest} to {largest} posts:')
+        for scenario in peaks[smallest]:
+            growth = (peaks[largest][scenario] - peaks[smallest][scenario]) / (largest - smallest) * 1000
+            print(f'  {scenario:<10}{growth:>8.2f} MB per 1000 posts')
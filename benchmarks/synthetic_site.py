@@ -0,0 +1,128 @@
+"""Generates a synthetic input directory shaped like a real blog, for benchmarking builds.
+
+    python3 benchmarks/synthetic_site.py OUTPUT_DIR [--posts N] [--seed S] [--page-size N]
+
+Posts live in deep `posts/YYYY/MM/DD` trees with front matter, code blocks in a few
+languages, local and remote images and `! include` modules. Listing pages preview them
+with `% posts`, `% posts:detailed` and `:#tag` filters, and every year has its own
+archive page previewing that year's subtree. With a page size, listings are paginated
+with `:page=N`.
+"""
+import os
+import random
+import argparse
+from datetime import date, timedelta
+
+TAGS = ['python', 'rust', 'gaming', 'design', 'music', 'travel', 'devlog', 'books', 'hardware', 'web']
+EMOJIS = ['🏰', '🐍', '🎮', '🎨', '🎵', '✈️', '🛠️', '📚', '💾', '🌐']
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit integer non mattis diam vivamus fermentum '
+         'eu nunc condimentum suspendisse tempus dui in fringilla vehicula mauris blandit sed convallis '
+         'velit metus pellentesque felis rhoncus commodo eros sodales luctus lacus nulla maximus').split()
+
+CODE_SAMPLES = {
+    'python': 'def fib(n):\n    a, b = 0, 1\n    for _ in range(n):\n        a, b = b, a + b\n    return a\n\nprint([fib(i) for i in range({n})])',
+    'rust': 'fn main() {{\n    let v: Vec<u64> = (0..{n}).map(|x| x * x).collect();\n    println!("{{:?}}", v);\n}}',
+    'javascript': 'const items = Array.from({{ length: {n} }}, (_, i) => i * 2);\nconsole.log(items.filter(x => x % 3 === 0));',
+    'bash': 'for i in $(seq 1 {n}); do\n  echo "item $i"\ndone | sort -r',
+    'css': '.card-{n} {{\n  display: grid;\n  grid-template-columns: repeat({n}, 1fr);\n  gap: 1rem;\n}}',
+}
+
+# Smallest valid PNG, used for the local images posts link to
+PIXEL_PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082'
+)
+
+def sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+def paragraph(rng):
+    return ' '.join(sentence(rng, rng.randint(8, 18)) for _ in range(rng.randint(3, 7)))
+
+def code_block(rng):
+    lang = rng.choice(sorted(CODE_SAMPLES))
+    return f'```{lang}\n{CODE_SAMPLES[lang].format(n=rng.randint(2, 40))}\n```'
+
+def post_markdown(rng, post_date, tags, has_image, featured=False):
+    blocks = [
+        '---',
+        f'emoji:  {rng.choice(EMOJIS)}',
+        f'date:   {post_date.isoformat()}',
+        'tags:   ' + '\n        '.join(tags),
+    ] + (['featured: true'] if featured else []) + [
+        '---',
+        '',
+        f'# {sentence(rng, rng.randint(3, 7))[:-1]}',
+        '',
+        paragraph(rng),
+    ]
+    for _ in range(rng.randint(2, 8)):
+        roll = rng.random()
+        if roll < 0.3:
+            blocks += ['', code_block(rng)]
+        elif roll < 0.4 and has_image:
+            blocks += ['', '![](./image.png)']
+        elif roll < 0.45:
+            blocks += ['', '![](https://example.com/static/img/remote.jpg)']
+        elif roll < 0.55:
+            blocks += ['', f'## {sentence(rng, 4)[:-1]}']
+        else:
+            blocks += ['', paragraph(rng)]
+    if rng.random() < 0.2:
+        blocks += ['', '! include snippet']
+    return '\n'.join(blocks) + '\n'
+
+def write_file(file_path, content):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    with open(file_path, 'wb') as f:
+        f.write(content)
+
+def generate_site(output_dir, posts=100, seed=0, page_size=None):
+    """Writes a site with `posts` posts to output_dir and returns the paths of the posts."""
+    rng = random.Random(seed)
+    page = f':page={page_size}' if page_size else ''
+
+    write_file(os.path.join(output_dir, 'modules', 'navbar.md'), '[Home](/index.html)\n[Blog](/blog.html)\n[Archive](/archive.html)\n')
+    write_file(os.path.join(output_dir, 'modules', 'footer.md'), 'A synthetic site for benchmarks.\n')
+    write_file(os.path.join(output_dir, 'modules', 'head_extras.html'), '<meta name="generator" content="synthetic">\n')
+    write_file(os.path.join(output_dir, 'modules', 'snippet.md'), '> This post is part of a series.\n\n```python\nprint("included")\n```\n')
+
+    write_file(os.path.join(output_dir, 'index.md'), f'## Home\n\n{paragraph(rng)}\n\n% posts:featured\n\n! include snippet\n')
+    write_file(os.path.join(output_dir, 'blog.md'), f'## Blog\n\n{paragraph(rng)}\n\n% posts:detailed{page}\n')
+    write_file(os.path.join(output_dir, 'archive.md'), f'## Archive\n\n% posts{page}\n')
+    for tag in TAGS[:3]:
+        write_file(os.path.join(output_dir, 'topics', f'{tag}.md'), f'## #{tag}\n\n% ../posts:detailed:#{tag}{page}\n')
+
+    post_paths = []
+    years = set()
+    start = date(2010, 1, 1)
+    for i in range(posts):
+        post_date = start + timedelta(days=rng.randint(0, 15 * 365))
+        years.add(post_date.year)
+        tags = rng.sample(TAGS, rng.randint(1, 3))
+        post_dir = os.path.join(output_dir, 'posts', f'{post_date.year}', f'{post_date.month:02}', f'{post_date.day:02}')
+        has_image = rng.random() < 0.3
+        if has_image:
+            write_file(os.path.join(post_dir, 'image.png'), PIXEL_PNG)
+        post_path = os.path.join(post_dir, f'post {i}.md')
+        write_file(post_path, post_markdown(rng, post_date, tags, has_image, featured=rng.random() < 0.05))
+        post_paths.append(post_path)
+
+    # Every year gets an archive page previewing its own subtree of posts
+    for year in sorted(years):
+        write_file(os.path.join(output_dir, 'archive', f'{year}.md'), f'## {year}\n\n% ../posts/{year}:detailed{page}\n')
+
+    return post_paths
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic site input directory.')
+    parser.add_argument('output_dir', help='Directory to write the site to')
+    parser.add_argument('--posts', type=int, default=100, help='Number of posts')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed generates the same site')
+    parser.add_argument('--page-size', type=int, default=None, help='Paginate listings with pages of N posts')
+    args = parser.parse_args()
+
+    generate_site(args.output_dir, args.posts, args.seed, args.page_size)
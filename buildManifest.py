@@ -0,0 +1,231 @@
+import os
+import json
+import hashlib
+from pageRecords import ContentSpool, extract_page_record, get_page_content, has_content
+
+MANIFEST_FILE_NAME = '.simplymarkdown-manifest.json'
+# Manifests of version 2 may hold `preview:` keys, which listing keys replaced
+MANIFEST_VERSION = 3
+
+def hash_text(text):
+    """Returns the sha256 hex digest of a string."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def get_contents_path(manifest_path, generation):
+    base, _ = os.path.splitext(manifest_path)
+    return f'{base}-contents-{generation}.bin'
+
+def hash_file(file_path):
+    """Returns the sha256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class BuildManifest:
+    """On-disk record of what every output was built from, used to skip unchanged outputs.
+
+    Each output is stored with a set of dependency keys and the hash each key had when
+    the output was written:
+
+    - `config`: the site wide options (root, title, favicon, highlight_classes, optimize, images,
+      search, reproducible), see siteBuilder.Site
+    - `template`: every file of the template directory
+    - `css`: the theme file
+    - `source:<relpath>`: an input file
+    - `module:<name>`: the module file(s) named `name` under `modules/`
+    - `listing:<json>`: the posts a `%` preview shows on one page, see markdownTags.get_listing_hash()
+    - `assets`: the fingerprinted names of static files, set with set_asset_map()
+
+    The main content of html pages is kept next to the manifest, in
+    `<manifest>-contents-<0 or 1>.bin`, so feeds and the search index get the content of
+    kept pages without parsing their output again. Builds alternate between the two files,
+    and the manifest names the one its entries point into, so an interrupted build leaves
+    the previous contents intact.
+    """
+
+    def __init__(self, manifest_path, input_path, template_path, css_path, config):
+        self.manifest_path = manifest_path
+        self.input_path = input_path
+        self.template_path = template_path
+        self.css_path = css_path
+        self.config_hash = hash_text(json.dumps(config, sort_keys=True))
+        self.previous = {}
+        self.entries = {}
+        self.file_stats = {}
+        self.new_file_stats = {}
+        self.hashes = {}
+        self.modules = None
+        self.asset_map = {}
+        self.contents_generation = None
+        self.previous_contents = None
+        self.contents = None
+        self.load()
+        self.start_build()
+
+    def load(self):
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != MANIFEST_VERSION:
+            return
+        self.previous = data.get('entries', {})
+        self.file_stats = data.get('files', {})
+        generation = data.get('contents')
+        if generation is not None and os.path.exists(get_contents_path(self.manifest_path, generation)):
+            self.contents_generation = generation
+            self.previous_contents = ContentSpool(get_contents_path(self.manifest_path, generation))
+
+    def save(self):
+        """Writes this build's entries to disk and starts a fresh build on the same object."""
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        generation = self.get_next_generation() if self.contents.file else None
+        self.contents.clear()
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries, 'files': self.new_file_stats, 'contents': generation}, f, sort_keys=True)
+        if self.previous_contents:
+            self.previous_contents.clear()
+            if self.contents_generation != generation:
+                os.remove(self.previous_contents.path)
+        self.previous = self.entries
+        self.file_stats = self.new_file_stats
+        self.contents_generation = generation
+        self.previous_contents = ContentSpool(get_contents_path(self.manifest_path, generation)) if generation is not None else None
+        self.start_build()
+
+    def start_build(self):
+        """Discards anything recorded by an unfinished build."""
+        self.entries = {}
+        self.new_file_stats = {}
+        self.hashes = {}
+        self.modules = None
+        if self.contents:
+            self.contents.clear()
+        self.contents = ContentSpool(get_contents_path(self.manifest_path, self.get_next_generation()))
+
+    def get_next_generation(self):
+        return 1 - (self.contents_generation or 0)
+
+    def set_asset_map(self, asset_map):
+        """Sets the fingerprinted asset names pages of this build link to."""
+        self.asset_map = asset_map
+        self.hashes.pop('assets', None)
+
+    def file_hash(self, file_path):
+        """Hashes a file, reusing the last build's hash when its size and mtime are unchanged."""
+        if file_path in self.new_file_stats:
+            return self.new_file_stats[file_path][2]
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return ''
+        cached = self.file_stats.get(file_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            digest = cached[2]
+        else:
+            digest = hash_file(file_path)
+        self.new_file_stats[file_path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def module_files(self, name):
+        if self.modules is None:
+            self.modules = {}
+            for root, _, files in os.walk(os.path.join(self.input_path, 'modules')):
+                for file in files:
+                    self.modules.setdefault(os.path.splitext(file)[0], []).append(os.path.join(root, file))
+        return sorted(self.modules.get(name, []))
+
+    def dependency_hash(self, key):
+        """Returns the current hash of a dependency key, memoized for the current build."""
+        if key in self.hashes:
+            return self.hashes[key]
+        kind, _, name = key.partition(':')
+        if kind == 'config':
+            digest = self.config_hash
+        elif kind == 'template':
+            # Every file of the template directory, since templates can extend each other and pages pick layouts
+            template_dir = os.path.dirname(self.template_path) or '.'
+            files = [file for file in sorted(os.listdir(template_dir)) if os.path.isfile(os.path.join(template_dir, file))]
+            digest = hash_text('\n'.join(f'{file}:{self.file_hash(os.path.join(template_dir, file))}' for file in files))
+        elif kind == 'css':
+            digest = self.file_hash(self.css_path)
+        elif kind == 'source':
+            digest = self.file_hash(os.path.join(self.input_path, name))
+        elif kind == 'module':
+            digest = hash_text('\n'.join(self.file_hash(path) for path in self.module_files(name)))
+        elif kind == 'listing':
+            # Both depend on this module through deployManifest
+            from markdownTags import get_listing_hash
+            from helpers import convert_to_html
+            relpath, directory_name, *view = json.loads(name)
+            digest = get_listing_hash(os.path.normpath(os.path.join(self.input_path, relpath)), directory_name, *view, convert_to_html)
+        elif kind == 'assets':
+            digest = hash_text(json.dumps(self.asset_map, sort_keys=True))
+        else:
+            raise ValueError(f'Unknown manifest dependency: {key}')
+        self.hashes[key] = digest
+        return digest
+
+    def is_fresh(self, output_relpath, output_path):
+        """Checks whether an output exists and none of its recorded dependencies changed."""
+        entry = self.previous.get(output_relpath)
+        if not entry or not os.path.exists(os.path.join(output_path, output_relpath)):
+            return False
+        return all(self.dependency_hash(key) == digest for key, digest in entry['deps'].items())
+
+    def keep(self, output_relpath):
+        """Carries a fresh output over into this build unchanged."""
+        entry = self.previous[output_relpath]
+        if 'page' in entry:
+            # The content is copied into this build's contents file, unparsed
+            content = self.read_previous_content(entry, output_relpath)
+            entry = dict(entry, content=self.contents.write(content) if content is not None else None)
+        self.entries[output_relpath] = entry
+
+    def read_previous_content(self, entry, output_relpath):
+        if 'content' in entry and self.previous_contents:
+            return self.previous_contents.read(*entry['content']) if entry['content'] is not None else None
+        # Manifests of older builds, or whose contents file is gone, have the output parsed once
+        with open(os.path.join(os.path.dirname(self.manifest_path), output_relpath), 'r', encoding='utf-8') as f:
+            return extract_page_record(f.read())['content']
+
+    def record(self, output_relpath, source, dependencies, page=None):
+        """Records an output written in this build along with its dependency hashes.
+
+        For html pages the page record is stored too, and its main content in the contents
+        file, so skipped pages still reach the sitemap, feeds and search index without their
+        html being parsed again.
+        """
+        self.entries[output_relpath] = {
+            'source': source,
+            'deps': {key: self.dependency_hash(key) for key in dependencies},
+        }
+        if page is not None:
+            self.entries[output_relpath]['page'] = {key: value for key, value in page.items() if key not in ('content', 'spooled', 'dependencies')}
+            if has_content(page):
+                content = get_page_content(page, None)
+                self.entries[output_relpath]['content'] = self.contents.write(content) if content is not None else None
+
+    def get_page(self, output_relpath):
+        """Returns the stored page record of an output kept from the previous build, with its content when it was stored."""
+        entry = self.entries[output_relpath]
+        page = dict(entry['page'])
+        if 'content' in entry:
+            page['content'] = self.contents.read(*entry['content']) if entry['content'] is not None else None
+        return page
+
+    def remove_stale(self, output_path):
+        """Deletes outputs of the previous build whose sources no longer exist."""
+        removed = []
+        for output_relpath in sorted(set(self.previous) - set(self.entries)):
+            output_file = os.path.join(output_path, output_relpath)
+            if os.path.exists(output_file):
+                os.remove(output_file)
+                removed.append(output_relpath)
+            # Precompressed siblings written by --optimize
+            for extension in ('.gz', '.br'):
+                if os.path.exists(output_file + extension):
+                    os.remove(output_file + extension)
+        return removed
@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import hashlib
+from pageRecords import get_page_content, has_content, content_spool
+
+SHARD_RECORDS_VERSION = 2
+SHARD_RECORDS_FILE_RE = re.compile(r'^\.simplymarkdown-shard-(\d+)-of-(\d+)\.jsonl$')
+
+def parse_shard(value):
+    """Parses a `--shard` value such as `2/4` into (2, 4); shards are numbered from 1."""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f'Invalid shard {value!r}, expected i/N with 1 <= i <= N')
+    return int(match.group(1)), int(match.group(2))
+
+def get_shard(relpath, shard_count):
+    """Returns the shard, from 1 to shard_count, a source belongs to.
+
+    Sources are assigned by a hash of their relative path, so every node of a build agrees
+    on the split without coordinating, and a source stays on its shard as others come and go.
+    """
+    digest = hashlib.sha256(relpath.replace(os.sep, '/').encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count + 1
+
+def is_in_shard(relpath, shard):
+    return shard is None or get_shard(relpath, shard[1]) == shard[0]
+
+def get_shard_manifest_name(manifest_name, shard):
+    """Every shard keeps its own build manifest, so shards sharing an output directory do not remove each other's outputs."""
+    base, extension = os.path.splitext(manifest_name)
+    return f'{base}-shard-{shard[0]}-of-{shard[1]}{extension}'
+
+def get_shard_records_path(output_path, shard):
+    return os.path.join(output_path, f'.simplymarkdown-shard-{shard[0]}-of-{shard[1]}.jsonl')
+
+def read_records_file(records_path):
+    """Yields the header of a shard's records file, then its records, spooling their contents as they are read."""
+    with open(records_path, 'r', encoding='utf-8') as f:
+        yield json.loads(f.readline() or 'null')
+        for line in f:
+            yield content_spool.spool(json.loads(line))
+
+def write_shard_records(output_path, shard, pages, sources=None):
+    """Writes the page records of a shard, with their main content, for the merge step.
+
+    Records are written as JSON lines, one per page after a header with the version, the
+    shard and `sources`, the pinned source times of a reproducible build (see
+    deployManifest.DeployManifest), so neither writing nor merging holds every content at once.
+
+    Pages an incremental build skipped have no content in their records; it is taken from
+    the shard's previous records, and only read back from the html when those lack it.
+    """
+    records_path = get_shard_records_path(output_path, shard)
+    missing = {page['path'] for page in pages if not has_content(page)}
+    previous = {}
+    if missing and os.path.exists(records_path):
+        records = read_records_file(records_path)
+        header = next(records)
+        if header and header.get('version') == SHARD_RECORDS_VERSION:
+            previous = {record['path']: record for record in records if record['path'] in missing}
+
+    temporary_path = f'{records_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'version': SHARD_RECORDS_VERSION, 'shard': list(shard), 'sources': sources}, ensure_ascii=False, sort_keys=True) + '\n')
+        for page in pages:
+            record = {key: value for key, value in page.items() if key not in ('dependencies', 'spooled')}
+            record['content'] = get_page_content(previous.get(page['path'], page), output_path)
+            f.write(json.dumps(record, ensure_ascii=False, sort_keys=True) + '\n')
+    os.replace(temporary_path, records_path)
+
+def read_shard_records(output_path):
+    """Combines the page records written by every shard of a build into one list, sorted by path.
+
+    Also returns the pinned source times the shards were built with, None unless the build was reproducible.
+
+    Raises ValueError when records of some shard are missing or shards of different builds are mixed.
+    """
+    found = {}
+    for file in sorted(os.listdir(output_path)):
+        match = SHARD_RECORDS_FILE_RE.match(file)
+        if match:
+            found.setdefault(int(match.group(2)), {})[int(match.group(1))] = os.path.join(output_path, file)
+    if len(found) != 1:
+        raise ValueError(f'Expected the shard records of one build in {output_path}, found builds of {sorted(found) or "no"} shards')
+
+    shard_count, files = found.popitem()
+    missing = sorted(set(range(1, shard_count + 1)) - set(files))
+    if missing:
+        raise ValueError(f'Missing the records of shard(s) {", ".join(f"{index}/{shard_count}" for index in missing)}')
+
+    pages = []
+    sources = None
+    for index in sorted(files):
+        records = read_records_file(files[index])
+        header = next(records)
+        if not header or header.get('version') != SHARD_RECORDS_VERSION:
+            raise ValueError(f'{files[index]} was written by another version of render.py')
+        pages.extend(records)
+        # Every shard pins the times of every source, from the same previous manifest
+        sources = sources or header.get('sources')
+    # Nodes may walk directories in different orders, paths give every merge the same one
+    return sorted(pages, key=lambda page: page['path']), sources
@@ -0,0 +1,121 @@
+import json
+import time
+from contextlib import contextmanager
+
+class BuildTimings:
+    """Collects time, call counts and bytes read and written per build stage, and time per page.
+
+    Disabled by default, in which case every hook returns right away. Stages nest, e.g.
+    `preview` and `pygments` run inside `convert_to_html`; a stage's time includes the
+    stages nested in it, and a stage re-entered by itself (previews convert the posts
+    they list) is only timed at the outermost call. Worker processes collect their own
+    timings, which are merged into the parent's with take() and merge().
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.pages = {}
+        self.active = []
+        self.current_page = None
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled or name in self.active:
+            yield
+            return
+        self.active.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.active.pop()
+            self.get_stage(self.stages, name)['seconds'] += elapsed
+            self.get_stage(self.stages, name)['calls'] += 1
+            if self.current_page is not None:
+                page_stages = self.pages[self.current_page]['stages']
+                page_stages[name] = page_stages.get(name, 0) + elapsed
+
+    @contextmanager
+    def page(self, name):
+        """Attributes the stages run inside the block to a page, and times the page as a whole."""
+        if not self.enabled:
+            yield
+            return
+        self.current_page = name
+        self.pages[name] = {'seconds': 0, 'stages': {}}
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.pages[name]['seconds'] = time.perf_counter() - start
+            self.current_page = None
+
+    def add_bytes(self, read=0, written=0):
+        """Counts bytes against the innermost running stage."""
+        if not self.enabled or not self.active:
+            return
+        stage = self.get_stage(self.stages, self.active[-1])
+        stage['bytes_read'] += read
+        stage['bytes_written'] += written
+
+    def get_stage(self, stages, name):
+        if name not in stages:
+            stages[name] = {'seconds': 0, 'calls': 0, 'bytes_read': 0, 'bytes_written': 0}
+        return stages[name]
+
+    def take(self):
+        """Returns what was collected since the last take() and starts over, for shipping out of a worker."""
+        if not self.enabled:
+            return None
+        snapshot = {'stages': self.stages, 'pages': self.pages}
+        self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        if not snapshot:
+            return
+        for name, values in snapshot['stages'].items():
+            stage = self.get_stage(self.stages, name)
+            for key, value in values.items():
+                stage[key] += value
+        self.pages.update(snapshot['pages'])
+
+    def slowest_pages(self, count=10):
+        return sorted(self.pages.items(), key=lambda item: item[1]['seconds'], reverse=True)[:count]
+
+    def to_json(self, total_seconds=None, slowest=10):
+        return {
+            'total_seconds': total_seconds,
+            'stages': self.stages,
+            'pages': self.pages,
+            'slowest_pages': [name for name, _ in self.slowest_pages(slowest)],
+        }
+
+    def write_json(self, file_path, total_seconds=None, slowest=10):
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_json(total_seconds, slowest), f, indent=2, sort_keys=True)
+
+    def format_table(self, total_seconds=None, slowest=10):
+        """Formats the stage totals and the slowest pages as plain text tables."""
+        lines = [f"{'stage':<28}{'calls':>8}{'seconds':>10}{'read KB':>11}{'written KB':>12}"]
+        for name, stage in sorted(self.stages.items(), key=lambda item: item[1]['seconds'], reverse=True):
+            lines.append(f"{name:<28}{stage['calls']:>8}{stage['seconds']:>10.3f}{stage['bytes_read'] / 1024:>11.1f}{stage['bytes_written'] / 1024:>12.1f}")
+        if total_seconds is not None:
+            lines.append(f"{'total (wall)':<28}{'':>8}{total_seconds:>10.3f}")
+
+        if self.pages:
+            lines.append('')
+            lines.append(f"{'slowest pages':<60}{'seconds':>10}  top stages")
+            for name, page in self.slowest_pages(slowest):
+                top = sorted(page['stages'].items(), key=lambda item: item[1], reverse=True)[:3]
+                top_stages = ', '.join(f'{stage} {seconds:.3f}' for stage, seconds in top)
+                lines.append(f"{name:<60}{page['seconds']:>10.3f}  {top_stages}")
+        return '\n'.join(lines)
+
+# Timings of the current process, enabled by render.py's --timings option
+timings = BuildTimings()
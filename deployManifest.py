@@ -0,0 +1,143 @@
+import os
+import json
+from datetime import datetime, timezone
+from buildManifest import hash_file
+
+DEPLOY_MANIFEST_FILE_NAME = '.simplymarkdown-deploy.json'
+DEPLOY_MANIFEST_VERSION = 1
+# Build bookkeeping in the output directory, left out of the deployed files
+BOOKKEEPING_PREFIX = '.simplymarkdown-'
+# Times sources are dated with instead of their mtimes, by absolute path, see DeployManifest.pin_source_times()
+_pinned_source_times = {}
+
+def pin_source_times(source_times):
+    """Dates the given sources, by absolute path, with fixed timestamps from now on; None unpins every source."""
+    _pinned_source_times.clear()
+    _pinned_source_times.update(source_times or {})
+
+def get_source_time(file_path):
+    """Returns the modification time a source is dated with."""
+    pinned = _pinned_source_times.get(os.path.abspath(file_path))
+    return pinned if pinned is not None else os.path.getmtime(file_path)
+
+def get_source_date(file_path):
+    """Returns the `%Y-%m-%d` date of a source without a `date` meta entry.
+
+    Pinned times are dated in UTC, so the output does not depend on the timezone of the build.
+    """
+    pinned = _pinned_source_times.get(os.path.abspath(file_path))
+    if pinned is not None:
+        return datetime.fromtimestamp(pinned, timezone.utc).strftime("%Y-%m-%d")
+    return datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y-%m-%d")
+
+def get_source_date_epoch():
+    """Returns the SOURCE_DATE_EPOCH environment variable (https://reproducible-builds.org/specs/source-date-epoch/), or None."""
+    value = os.environ.get('SOURCE_DATE_EPOCH', '').strip()
+    return int(value) if value.isdigit() else None
+
+class DeployManifest:
+    """Content hashes of the files of a build's output and what changed since the previous build.
+
+    Written to `.simplymarkdown-deploy.json` in the output directory:
+
+    - `files`: the sha256 of every output file, by relpath
+    - `added`, `modified`: the files that are new or whose content changed, with their sha256
+    - `deleted`: the relpaths of the files the previous build had and this one does not
+    - `sources`: the sha256 and pinned time of every page source
+    - `stats`: the size and mtime_ns the `files` and `sources` hashes were taken at, so the
+      next build only hashes the files whose stat changed
+
+    Deploy tooling uploads `added` and `modified` and deletes `deleted`. Sources without a
+    `date` meta entry are dated by their mtime, which a fresh checkout resets, so the build
+    pins them: a source whose content is unchanged since the previous manifest keeps its
+    time, others take their mtime, clamped to SOURCE_DATE_EPOCH when it is set.
+    """
+
+    def __init__(self, output_path, previous_path=None):
+        self.output_path = output_path
+        self.previous_path = previous_path or os.path.join(output_path, DEPLOY_MANIFEST_FILE_NAME)
+        self.previous_files = {}
+        self.previous_sources = {}
+        self.previous_stats = {'files': {}, 'sources': {}}
+        self.sources = {}
+        self.stats = {'files': {}, 'sources': {}}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.previous_path):
+            return
+        with open(self.previous_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == DEPLOY_MANIFEST_VERSION:
+            self.previous_files = data['files']
+            self.previous_sources = data['sources']
+            self.previous_stats = data.get('stats', self.previous_stats)
+
+    def hash_file(self, file_path, relpath, kind, previous_digest):
+        """Hashes a file of the output (`kind` 'files') or input ('sources'), reusing the previous digest when its size and mtime are unchanged."""
+        stat = os.stat(file_path)
+        self.stats[kind][relpath] = [stat.st_size, stat.st_mtime_ns]
+        if previous_digest and self.previous_stats[kind].get(relpath) == self.stats[kind][relpath]:
+            return previous_digest
+        return hash_file(file_path)
+
+    def pin_source_times(self, input_path, source_date_epoch=None, file_hash=None):
+        """Pins the time of every markdown and html source of the input, returning them by absolute path.
+
+        `file_hash` hashes a source by its path, such as the stat cached BuildManifest.file_hash()
+        of incremental builds; by default the stats of the previous deploy manifest are used.
+        """
+        self.sources = {}
+        self.stats['sources'] = {}
+        source_times = {}
+        for root, dirs, files in os.walk(input_path):
+            dirs.sort()
+            for file in sorted(files):
+                if not file.lower().endswith(('.md', '.html')):
+                    continue
+                file_path = os.path.join(root, file)
+                relpath = os.path.relpath(file_path, input_path).replace(os.sep, '/')
+                previous = self.previous_sources.get(relpath)
+                if file_hash:
+                    digest = file_hash(file_path)
+                else:
+                    digest = self.hash_file(file_path, relpath, 'sources', previous[0] if previous else None)
+                if previous and previous[0] == digest:
+                    source_time = previous[1]
+                else:
+                    source_time = int(os.path.getmtime(file_path))
+                    if source_date_epoch is not None:
+                        source_time = min(source_time, source_date_epoch)
+                self.sources[relpath] = [digest, source_time]
+                source_times[os.path.abspath(file_path)] = source_time
+        return source_times
+
+    def hash_output(self):
+        """Hashes the files of the output, only reading those whose size or mtime changed since the previous manifest."""
+        files = {}
+        self.stats['files'] = {}
+        for root, dirs, names in os.walk(self.output_path):
+            dirs.sort()
+            for name in sorted(names):
+                file_path = os.path.join(root, name)
+                if root == self.output_path and name.startswith(BOOKKEEPING_PREFIX):
+                    continue
+                relpath = os.path.relpath(file_path, self.output_path).replace(os.sep, '/')
+                files[relpath] = self.hash_file(file_path, relpath, 'files', self.previous_files.get(relpath))
+        return files
+
+    def write(self):
+        """Hashes the output and writes the manifest next to it. Returns the number of added, modified and deleted files."""
+        files = self.hash_output()
+        added = {path: digest for path, digest in files.items() if path not in self.previous_files}
+        modified = {path: digest for path, digest in files.items() if path in self.previous_files and self.previous_files[path] != digest}
+        deleted = sorted(set(self.previous_files) - set(files))
+
+        manifest_path = os.path.join(self.output_path, DEPLOY_MANIFEST_FILE_NAME)
+        temporary_path = f'{manifest_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': DEPLOY_MANIFEST_VERSION, 'files': files, 'added': added, 'modified': modified, 'deleted': deleted, 'sources': self.sources,
+                       'stats': self.stats},
+                      f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(temporary_path, manifest_path)
+        return len(added), len(modified), len(deleted)
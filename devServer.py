@@ -0,0 +1,131 @@
+import os
+import time
+import traceback
+import threading
+import functools
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    # Without watchdog the watched paths are polled instead
+    Observer = None
+    FileSystemEventHandler = object
+
+class SiteRequestHandler(SimpleHTTPRequestHandler):
+    """Serves the output directory, resolving the extensionless urls used in canonical links."""
+
+    def translate_path(self, path):
+        file_path = super().translate_path(path)
+        if not os.path.exists(file_path) and os.path.exists(file_path + '.html'):
+            return file_path + '.html'
+        return file_path
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(output_path, port=8000):
+    """Starts serving output_path on localhost in a background thread and returns the server."""
+    handler = functools.partial(SiteRequestHandler, directory=output_path)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def snapshot(paths):
+    """Returns the size and mtime of every file under the given files and directories."""
+    state = {}
+    pending = list(paths)
+    while pending:
+        path = pending.pop()
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            state[path] = (stat.st_size, stat.st_mtime_ns)
+            continue
+        try:
+            entries = os.scandir(path)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                else:
+                    stat = entry.stat()
+                    state[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return state
+
+class ChangeHandler(FileSystemEventHandler):
+    def __init__(self, changed, paths):
+        self.changed = changed
+        self.paths = [os.path.abspath(path) for path in paths]
+
+    def is_watched(self, path):
+        path = os.path.abspath(path)
+        return any(path == watched or path.startswith(watched + os.sep) for watched in self.paths)
+
+    def on_any_event(self, event):
+        # Reads show up as opened/closed events; only content and tree changes trigger a rebuild
+        if event.event_type not in ('created', 'deleted', 'modified', 'moved'):
+            return
+        if event.is_directory and event.event_type == 'modified':
+            return
+        if self.is_watched(event.src_path) or self.is_watched(getattr(event, 'dest_path', '') or event.src_path):
+            self.changed.set()
+
+def wait_for_changes_polling(paths, interval):
+    """Yields every time a file under paths is added, removed or modified."""
+    state = snapshot(paths)
+    while True:
+        time.sleep(interval)
+        new_state = snapshot(paths)
+        if new_state != state:
+            state = new_state
+            yield
+
+def wait_for_changes_watchdog(paths, interval):
+    changed = threading.Event()
+    observer = Observer()
+    handler = ChangeHandler(changed, paths)
+    for path in paths:
+        # Single files are watched through their directory
+        if os.path.isfile(path):
+            observer.schedule(handler, os.path.dirname(os.path.abspath(path)), recursive=False)
+        else:
+            observer.schedule(handler, path, recursive=True)
+    observer.start()
+    try:
+        while True:
+            changed.wait()
+            # Let a burst of events from a single save settle before rebuilding
+            time.sleep(interval)
+            changed.clear()
+            yield
+    finally:
+        observer.stop()
+        observer.join()
+
+def wait_for_changes(paths, interval=0.2):
+    """Yields after each batch of file changes, using filesystem notifications when watchdog is installed."""
+    if Observer is not None:
+        return wait_for_changes_watchdog(paths, min(interval, 0.05))
+    return wait_for_changes_polling(paths, interval)
+
+def watch(paths, rebuild, output_path, port=8000, interval=0.2):
+    """Serves output_path and calls rebuild() whenever a watched path changes, until interrupted."""
+    server = serve(output_path, port)
+    print(f'Serving {output_path} at http://127.0.0.1:{server.server_address[1]}/ (Ctrl+C to stop)')
+    try:
+        for _ in wait_for_changes(paths, interval):
+            start = time.perf_counter()
+            try:
+                rebuild()
+            except Exception:
+                # Keep serving the last good build while the sources are being fixed
+                traceback.print_exc()
+                continue
+            print(f'Rebuilt in {time.perf_counter() - start:.3f}s')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
@@ -1,127 +1,179 @@
 import os
+import re
+import json
+import heapq
 import fnmatch
 import argparse
-from xml.etree.ElementTree import Element, SubElement, ElementTree
-from bs4 import BeautifulSoup
+from xml.sax.saxutils import escape
+from pageRecords import read_page_records, get_page_content
+from outputOptimizer import replace_if_changed, write_if_changed
 from email.utils import parsedate_to_datetime
-from datetime import datetime
-
-def extract_metadata(html_content, last_edit):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    title = soup.find('title').text if soup.find('title') else 'No title'
-    pub_date_meta = soup.find('meta', {'name': 'pubDate'}) or soup.find('meta', {'name': 'pubdate'})
-    pub_date = pub_date_meta['content'] if pub_date_meta else None
-    pub_date = pub_date or last_edit
-    main_content = str(soup.find('main')) if soup.find('main') else 'No content'
-    category_tags = [tag.text.strip() for tag in soup.find_all('categorytag')]
-
-    return title, pub_date, main_content, category_tags
-
-def parse_main_content(main_content):
-    soup = BeautifulSoup(main_content, 'html.parser')
-
-    # Remove all <script> and <style> elements
-    for script_or_style in soup(['script', 'style', 'parsers-ignore', 'categorytag']):
-        script_or_style.decompose()
-
-    # Remove all style attributes
-    for tag in soup.find_all(True):
-        tag.attrs = {key: value for key, value in tag.attrs.items() if key != 'style'}
-
-    # Add max-width:100% to all img elements
-    for img in soup.find_all('img'):
-        img['style'] = 'max-width:100%;'
-
-    cleaned_content = str(soup)
-    return cleaned_content
-
-def generate_rss_feed(root_directory, urlroot='', uri_whitelist='*', feed_title='My RSS Feed', feed_description='This is an RSS feed of my website.'):
-    def get_html_files(directory):
-        html_files = []
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.lower().endswith('.html'):
-                    file_path = os.path.join(root, file)
-                    html_files.append(file_path)
-        return html_files
-
-    def is_uri_whitelisted(uri, whitelist_patterns):
-        for pattern in whitelist_patterns:
-            if fnmatch.fnmatch(uri, pattern):
-                return True
-        return False
-
-    html_files = get_html_files(root_directory)
+from datetime import datetime, timezone
+
+OLDEST_DATE = datetime.min.replace(tzinfo=timezone.utc)
+# The per-tag and per-directory feeds of the last build, so the ones no longer written are removed
+FEEDS_FILE_NAME = '.simplymarkdown-feeds.json'
+
+def format_last_edit(mtime):
+    return datetime.fromtimestamp(mtime, timezone.utc).strftime("%a, %d %b %Y %H:%M:%S +0000")
+
+def is_uri_whitelisted(uri, whitelist_patterns):
+    for pattern in whitelist_patterns:
+        if fnmatch.fnmatch(uri, pattern):
+            return True
+    return False
+
+def get_sort_date(pub_date):
+    """Parses a pubDate for sorting; items without a valid one sort as the oldest."""
+    if pub_date:
+        try:
+            date = parsedate_to_datetime(pub_date)
+            return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+        except (TypeError, ValueError):
+            pass
+    return OLDEST_DATE
+
+def get_feed_slug(name):
+    return re.sub(r'[^\w-]+', '-', name).strip('-').lower()
+
+def xml_element(tag, text):
+    return f'<{tag}>{escape(text)}</{tag}>' if text else f'<{tag} />'
+
+class FeedSelection:
+    """Keeps the newest `limit` items of a feed in a heap, so memory is bounded by the limit."""
+
+    def __init__(self, output_file, title, limit=None):
+        self.output_file = output_file
+        self.title = title
+        self.limit = limit
+        self.items = []
+
+    def add(self, sort_date, sequence, pub_date, page):
+        # Equal dates keep input order, like a stable sort by date descending would
+        entry = (sort_date, -sequence, pub_date, page)
+        if self.limit is None or len(self.items) < self.limit:
+            heapq.heappush(self.items, entry)
+        elif entry[:2] > self.items[0][:2]:
+            heapq.heapreplace(self.items, entry)
+
+    def selected(self):
+        return [entry[2:] for entry in sorted(self.items, key=lambda entry: entry[:2], reverse=True)]
+
+def write_feed(selection, root_directory, urlroot, feed_description, full_content):
+    """Writes one feed, item by item, parsing item bodies only for the selected items.
+
+    The feed is streamed to a temporary file and left untouched when it is unchanged.
+    """
+    os.makedirs(os.path.dirname(selection.output_file), exist_ok=True)
+    temporary_path = f'{selection.output_file}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as feed_file:
+        feed_file.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        feed_file.write('<rss version="2.0"><channel>')
+        feed_file.write(xml_element('title', selection.title))
+        feed_file.write(xml_element('link', urlroot))
+        feed_file.write(xml_element('description', feed_description))
+
+        for pub_date, page in selection.selected():
+            if full_content:
+                content = get_page_content(page, root_directory)
+                description = content if content is not None else 'No content'
+            else:
+                description = page.get('description') or ''
+
+            feed_file.write('<item>')
+            feed_file.write(xml_element('title', page['title'] if page['title'] is not None else 'No title'))
+            feed_file.write(xml_element('link', page['url']))
+            feed_file.write(xml_element('guid', page['url']))
+            if pub_date:
+                feed_file.write(xml_element('pubDate', pub_date))
+            feed_file.write(xml_element('description', description))
+            # Add categories
+            for category in page['tags']:
+                feed_file.write(xml_element('category', category))
+            feed_file.write('</item>')
+
+        feed_file.write('</channel></rss>')
+    return replace_if_changed(temporary_path, selection.output_file)
+
+def write_rss_feed(pages, root_directory, urlroot='', uri_whitelist='*', feed_title='My RSS Feed', feed_description='This is an RSS feed of my website.',
+                   limit=None, full_content=True, per_tag=False, per_directory=False):
+    """Writes rss.xml from page records, plus optional per-tag and per-directory feeds, in one pass.
+
+    Only the newest `limit` items of each feed are kept while the records stream by, and
+    item bodies are read for those items alone. Per-tag feeds go to `tags/<tag>/rss.xml`
+    and per-directory feeds to `<top level directory>/rss.xml`. Records marked `generated`,
+    the pages --tag-pages adds under `tags/` and the later pages of paginated listings, are
+    left out of per-directory feeds. Feeds of the previous build that are not written again,
+    for tags or directories that are gone, are removed.
+    """
     whitelist_patterns = uri_whitelist.split(',')
+    main_feed = FeedSelection(os.path.join(root_directory, 'rss.xml'), feed_title, limit)
+    tag_feeds = {}
+    directory_feeds = {}
 
-    rss = Element('rss', version='2.0')
-    channel = SubElement(rss, 'channel')
-    title = SubElement(channel, 'title')
-    title.text = feed_title
-    link = SubElement(channel, 'link')
-    link.text = urlroot
-    description = SubElement(channel, 'description')
-    description.text = feed_description
-
-    feed_items = []
-
-    for file_path in html_files:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            html_content = file.read()
-
-        last_edit = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%a, %d %b %Y %H:%M:%S +0000") # Naive, assume UTC
-        item_title, pub_date, main_content, category_tags = extract_metadata(html_content, last_edit)
-        url = file_path.replace(root_directory, urlroot + '/').replace('\\', '/').lstrip('/')
-        url = url.replace('//', '/')
-        url = url.replace('https:/', 'https://')
-        url = url.replace(".html", "")
-
-        uri = file_path.replace(root_directory, '')
+    for sequence, page in enumerate(pages):
+        uri = '/' + page['path'].replace('\\', '/')
         if not is_uri_whitelisted(uri, whitelist_patterns):
             continue
 
-        parsed_content = parse_main_content(main_content)
-
-        feed_items.append({
-            'title': item_title,
-            'link': url,
-            'guid': url,
-            'pubDate': pub_date,
-            'description': parsed_content,
-            'categories': category_tags,
-        })
-
-    # Sort items by pubDate in descending order
-    def sort_key(item):
-        if item['pubDate']:
-            try:
-                return parsedate_to_datetime(item['pubDate'])
-            except (TypeError, ValueError):
-                pass
-        return datetime.min  # Default to the oldest possible date for items without valid pubDate
-
-    feed_items.sort(key=sort_key, reverse=True)
-
-    for item_data in feed_items:
-        item = SubElement(channel, 'item')
-        item_title_elem = SubElement(item, 'title')
-        item_title_elem.text = item_data['title']
-        link_elem = SubElement(item, 'link')
-        link_elem.text = item_data['link']
-        guid_elem = SubElement(item, 'guid')
-        guid_elem.text = item_data['guid']
-        if item_data['pubDate']:
-            pub_date_elem = SubElement(item, 'pubDate')
-            pub_date_elem.text = item_data['pubDate']
-        description_elem = SubElement(item, 'description')
-        description_elem.text = item_data['description']
-        # Add categories
-        for category in item_data['categories']:
-            category_elem = SubElement(item, 'category')
-            category_elem.text = category
-
-    output_file = os.path.join(root_directory, 'rss.xml')
-    ElementTree(rss).write(output_file, encoding='utf-8', xml_declaration=True)
+        pub_date = page['date']
+        if not pub_date and page.get('mtime'):
+            pub_date = format_last_edit(page['mtime'])
+        sort_date = get_sort_date(pub_date)
+
+        main_feed.add(sort_date, sequence, pub_date, page)
+
+        if per_tag:
+            for tag in {tag.strip() for tag in page['tags'] if tag.strip()}:
+                slug = get_feed_slug(tag)
+                if slug not in tag_feeds:
+                    tag_feeds[slug] = FeedSelection(os.path.join(root_directory, 'tags', slug, 'rss.xml'), f'{feed_title} - #{tag}', limit)
+                tag_feeds[slug].add(sort_date, sequence, pub_date, page)
+
+        directory = uri.lstrip('/').split('/')[0] if '/' in uri.lstrip('/') else None
+        if per_directory and directory and not page.get('generated'):
+            if directory not in directory_feeds:
+                directory_feeds[directory] = FeedSelection(os.path.join(root_directory, directory, 'rss.xml'), f'{feed_title} - {directory}', limit)
+            directory_feeds[directory].add(sort_date, sequence, pub_date, page)
+
+    for selection in [main_feed] + [tag_feeds[slug] for slug in sorted(tag_feeds)] + [directory_feeds[name] for name in sorted(directory_feeds)]:
+        write_feed(selection, root_directory, urlroot, feed_description, full_content)
+
+    feeds = sorted(os.path.relpath(selection.output_file, root_directory).replace(os.sep, '/') for selection in list(tag_feeds.values()) + list(directory_feeds.values()))
+    remove_stale_feeds(root_directory, feeds)
+
+def remove_stale_feeds(root_directory, feeds):
+    """Deletes the per-tag and per-directory feeds of the previous build that `feeds` no longer lists, and records `feeds`."""
+    feeds_file = os.path.join(root_directory, FEEDS_FILE_NAME)
+    try:
+        with open(feeds_file, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous = []
+    for relpath in sorted(set(previous) - set(feeds)):
+        feed_file = os.path.join(root_directory, relpath)
+        # Precompressed siblings written by --optimize
+        for path in (feed_file, feed_file + '.gz', feed_file + '.br'):
+            if os.path.exists(path):
+                os.remove(path)
+        if relpath.startswith('tags/'):
+            # The directory of a tag's feed only holds the feed, and tags/ only those directories without --tag-pages
+            for directory in (os.path.dirname(feed_file), os.path.join(root_directory, 'tags')):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+    if feeds:
+        write_if_changed(feeds_file, json.dumps(feeds, indent=1).encode('utf-8'))
+    elif previous:
+        os.remove(feeds_file)
+
+def generate_rss_feed(root_directory, urlroot='', uri_whitelist='*', feed_title='My RSS Feed', feed_description='This is an RSS feed of my website.', pages=None,
+                      limit=None, full_content=True, per_tag=False, per_directory=False):
+    """Writes the feed of the given page records, or of every html file in root_directory."""
+    if pages is None:
+        pages = read_page_records(root_directory, urlroot)
+    write_rss_feed(pages, root_directory, urlroot, uri_whitelist, feed_title, feed_description, limit, full_content, per_tag, per_directory)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Generate an RSS feed from HTML files.')
@@ -130,6 +182,11 @@ if __name__ == '__main__':
     parser.add_argument('--whitelist', default='*', help='Comma-separated list of URI patterns to include in the feed (supports wildcards).')
     parser.add_argument('--title', default='My RSS Feed', help='Title of the RSS feed.')
     parser.add_argument('--description', default='This is an RSS feed of my website.', help='Description of the RSS feed.')
+    parser.add_argument('--limit', type=int, default=None, help='Only include the newest N items.')
+    parser.add_argument('--content', choices=['full', 'summary'], default='full', help='Include full page content or only the page description.')
+    parser.add_argument('--per-tag', action='store_true', help='Also write a feed per tag under tags/<tag>/rss.xml.')
+    parser.add_argument('--per-directory', action='store_true', help='Also write a feed per top level directory under <directory>/rss.xml.')
 
     args = parser.parse_args()
-    generate_rss_feed(args.root_directory, args.urlroot, args.whitelist, args.title, args.description)
+    generate_rss_feed(args.root_directory, args.urlroot, args.whitelist, args.title, args.description, None,
+                      args.limit, args.content == 'full', args.per_tag, args.per_directory)
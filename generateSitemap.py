@@ -1,50 +1,142 @@
 import os
-from bs4 import BeautifulSoup
-
-def generate_sitemap(root_directory, urlroot=''):
-    def get_html_files(directory):
-        html_files = []
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.lower().endswith('.html'):
-                    file_path = os.path.join(root, file)
-                    html_files.append(file_path)
-        return html_files
-
-    def get_canonical_url(file_path):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            soup = BeautifulSoup(file, 'html.parser')
-            canonical_link = soup.find('link', rel='canonical')
-            if canonical_link and canonical_link.has_attr('href'):
-                return canonical_link['href']
-        return None
-
-    html_files = get_html_files(root_directory)
-
-    output_file = os.path.join(root_directory, 'sitemap.xml')
-
-    with open(output_file, 'w', encoding='utf-8') as sitemap_file:
-        sitemap_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        sitemap_file.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
-
-        for file_path in html_files:
-            print('-------in-----')
-            canonical_url = get_canonical_url(file_path)
-            print(canonical_url, file_path)
-            if canonical_url:
-                if not canonical_url.startswith(urlroot):
-                    url = (urlroot + canonical_url).replace('//', '/')
-                    url = url.replace('https:/', 'https://')
-                else:
-                    url = canonical_url
-            else:
-                url = file_path.replace(root_directory, urlroot + '/').replace('\\', '/').lstrip('/')
-                url = url.replace('//', '/')
-                url = url.replace('https:/', 'https://')
-                url = url.replace(".html", "")
-
-            sitemap_file.write(f'  <url>\n')
-            sitemap_file.write(f'    <loc>{url}</loc>\n')
-            sitemap_file.write(f'  </url>\n')
-
-        sitemap_file.write('</urlset>\n')
+import re
+import gzip
+import argparse
+from xml.sax.saxutils import escape
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from pageRecords import read_page_records
+
+# Protocol limit of urls per sitemap file
+SITEMAP_MAX_URLS = 50000
+SITEMAP_FILE_RE = re.compile(r'^sitemap(-\d+|-index)?\.xml(\.gz)?$')
+
+def get_page_loc(page, urlroot=''):
+    canonical_url = page['canonical']
+    if canonical_url:
+        if not canonical_url.startswith(urlroot):
+            url = (urlroot + canonical_url).replace('//', '/')
+            return url.replace('https:/', 'https://')
+        return canonical_url
+    return page['url']
+
+def get_page_lastmod(page, root_directory):
+    """Returns a W3C datetime from the page's pubDate meta, or from its file's mtime."""
+    if page['date']:
+        try:
+            date = parsedate_to_datetime(page['date'])
+            return (date if date.tzinfo else date.replace(tzinfo=timezone.utc)).astimezone(timezone.utc).isoformat()
+        except (TypeError, ValueError):
+            pass
+    mtime = page.get('mtime')
+    if mtime is None:
+        try:
+            mtime = os.path.getmtime(os.path.join(root_directory, page['path']))
+        except OSError:
+            return None
+    return datetime.fromtimestamp(int(mtime), timezone.utc).isoformat()
+
+def get_sitemap_url(urlroot, file_name):
+    return (urlroot.rstrip('/') + '/' + file_name) if urlroot else file_name
+
+def write_if_changed(output_file, text, compress=False):
+    """Writes a sitemap file unless the same bytes are already on disk, returning whether it wrote."""
+    data = text.encode('utf-8')
+    if compress:
+        # mtime=0 keeps the gzip header, and so the file, identical for identical content
+        data = gzip.compress(data, mtime=0)
+    try:
+        with open(output_file, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(output_file, 'wb') as f:
+        f.write(data)
+    return True
+
+class SitemapShard:
+    def __init__(self):
+        self.entries = []
+        self.lastmod = None
+
+    def add(self, loc, lastmod):
+        self.entries.append(f'  <url>\n    <loc>{escape(loc)}</loc>\n')
+        if lastmod:
+            self.entries.append(f'    <lastmod>{lastmod}</lastmod>\n')
+            self.lastmod = max(self.lastmod or lastmod, lastmod)
+        self.entries.append('  </url>\n')
+
+    def text(self):
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+                + ''.join(self.entries) +
+                '</urlset>\n')
+
+def write_sitemap(pages, root_directory, urlroot='', compress=False, max_urls=SITEMAP_MAX_URLS):
+    """Writes sitemap.xml from page records, sharding into sitemap-N.xml files and a sitemap-index.xml past max_urls.
+
+    Shards are built one at a time while the records stream by, and only the files whose
+    content changed are rewritten. Returns the names of the sitemap files that were written.
+    """
+    extension = '.xml.gz' if compress else '.xml'
+    written = []
+    shards = []
+    shard = SitemapShard()
+    count = 0
+    pending = None
+
+    def flush(shard, number):
+        file_name = f'sitemap-{number}{extension}'
+        if write_if_changed(os.path.join(root_directory, file_name), shard.text(), compress):
+            written.append(file_name)
+        shards.append((file_name, shard.lastmod))
+
+    for page in pages:
+        if count == max_urls:
+            # Only a full shard followed by more pages needs sharding, so the first one is held back
+            if pending is not None:
+                flush(pending, len(shards) + 1)
+            pending, shard, count = shard, SitemapShard(), 0
+        shard.add(get_page_loc(page, urlroot), get_page_lastmod(page, root_directory))
+        count += 1
+
+    if pending is None:
+        file_names = {f'sitemap{extension}'}
+        if write_if_changed(os.path.join(root_directory, f'sitemap{extension}'), shard.text(), compress):
+            written.append(f'sitemap{extension}')
+    else:
+        flush(pending, len(shards) + 1)
+        flush(shard, len(shards) + 1)
+        index = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+                 '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+        for file_name, lastmod in shards:
+            index.append(f'  <sitemap>\n    <loc>{escape(get_sitemap_url(urlroot, file_name))}</loc>\n')
+            if lastmod:
+                index.append(f'    <lastmod>{lastmod}</lastmod>\n')
+            index.append('  </sitemap>\n')
+        index.append('</sitemapindex>\n')
+        if write_if_changed(os.path.join(root_directory, 'sitemap-index.xml'), ''.join(index)):
+            written.append('sitemap-index.xml')
+        file_names = {file_name for file_name, _ in shards} | {'sitemap-index.xml'}
+
+    # Drop shards left over from a previous, larger or differently compressed, sitemap
+    for file_name in os.listdir(root_directory):
+        if SITEMAP_FILE_RE.match(file_name) and file_name not in file_names:
+            os.remove(os.path.join(root_directory, file_name))
+    return written
+
+def generate_sitemap(root_directory, urlroot='', pages=None, compress=False):
+    """Writes the sitemap of the given page records, or of every html file in root_directory."""
+    if pages is None:
+        pages = read_page_records(root_directory, urlroot)
+    return write_sitemap(pages, root_directory, urlroot, compress)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a sitemap from HTML files.')
+    parser.add_argument('root_directory', help='Root directory containing HTML files.')
+    parser.add_argument('--urlroot', default='', help='Root URL for the sitemap links.')
+    parser.add_argument('--gzip', action='store_true', help='Gzip the sitemap files.')
+
+    args = parser.parse_args()
+    generate_sitemap(args.root_directory, args.urlroot, None, args.gzip)
@@ -2,20 +2,63 @@ import os
 import re
 import shutil 
 from datetime import datetime
-from markdownTags import PreviewExtension, extract_first_paragraph, get_first_title
-from markdown.extensions.codehilite import CodeHiliteExtension
-import markdown
-from markdown.extensions import Extension
-from jinja2 import Environment, FileSystemLoader
+from markdownTags import extract_first_paragraph, get_first_title
+from buildTimings import timings
+from assetPipeline import copy_asset
+from deployManifest import pin_source_times
+
+# markdown, pygments and jinja2 are imported by the functions using them, so builds and
+# commands that convert nothing, such as incremental no-ops and `merge`, never load them.
+
+# Options shared by every stage of a build, set with configure()
+BUILD_OPTIONS = {
+    'cache_dir': None,
+    'highlight_classes': False,
+    # None keeps highlightCache.DEFAULT_MAX_BYTES
+    'highlight_cache_bytes': None,
+    'timings': False,
+    'copy_mode': 'copy',
+    'optimize': False,
+    # Widths, formats, quality and sizes of responsive images, None when disabled
+    'images': None,
+    'search': False,
+    # Byte-stable output: sources are walked in sorted order and dated with pinned times
+    'reproducible': False,
+    # Pinned times of the sources by absolute path, see deployManifest.DeployManifest.pin_source_times()
+    'source_times': None,
+}
+
+# Options converters and template environments are built with
+CONVERTER_OPTIONS = ('cache_dir', 'highlight_classes', 'highlight_cache_bytes')
+
+def configure(**options):
+    """Sets build wide options; process pool workers are configured with the same values.
+
+    Converters and template environments are kept for later builds unless the options
+    they are built with change.
+    """
+    changed = any(options[name] != BUILD_OPTIONS[name] for name in CONVERTER_OPTIONS if name in options)
+    BUILD_OPTIONS.update(options)
+    timings.enabled = BUILD_OPTIONS['timings']
+    pin_source_times(BUILD_OPTIONS['source_times'])
+    if changed:
+        _converter_pool.clear()
+        _template_environments.clear()
+
+def get_build_highlight_cache():
+    """Returns the highlight cache the build's options select."""
+    from highlightCache import get_highlight_cache, DEFAULT_MAX_BYTES
+    return get_highlight_cache(BUILD_OPTIONS['cache_dir'], BUILD_OPTIONS['highlight_cache_bytes'] or DEFAULT_MAX_BYTES)
 
 def setup_codehilite():
+    from markdown.extensions.codehilite import CodeHiliteExtension
     # Define the options for the CodeHiliteExtension
     options = {
-        'noclasses': True,
+        'noclasses': not BUILD_OPTIONS['highlight_classes'],
         'pygments_options': {'style': 'colorful'},
         'css_class': 'highlight',
         'use_pygments': True,
-        'inline_css': True,
+        'inline_css': not BUILD_OPTIONS['highlight_classes'],
     }
 
     # Create an instance of the CodeHiliteExtension with the modified options
@@ -26,19 +69,45 @@ def read_file_content(file_path):
     with open(file_path, 'r') as file:
         return file.read()
 
-def convert_to_html(content, base_path=''):
-    """Converts markdown content to HTML."""
-    extensions = [
+def markdown_extensions(base_path=''):
+    """Returns the extensions every markdown converter is configured with."""
+    from previewExtension import PreviewExtension
+    from highlightCache import HighlightCacheExtension
+    codehilite = setup_codehilite()
+    return [
         'markdown.extensions.extra',
         'markdown.extensions.tables',
         'markdown.extensions.fenced_code',
         'markdown.extensions.toc',
         'meta',
         PreviewExtension(base_path=base_path, processor=convert_to_html), 
-        setup_codehilite(),
+        codehilite,
+        HighlightCacheExtension(codehilite, get_build_highlight_cache()),
     ]
-    md = markdown.Markdown(extensions=extensions)
-    return md.convert(content), md.Meta
+
+# Idle, fully configured markdown converters. Building one means instantiating every
+# extension, so they are reused with reset() instead. Nested conversions (previews
+# convert the posts they list) find the pool empty and get a converter of their own.
+_converter_pool = []
+
+def create_converter():
+    import markdown
+    return markdown.Markdown(extensions=markdown_extensions())
+
+def convert_to_html(content, base_path='', page_stem=None, page_number=1):
+    """Converts markdown content to HTML.
+
+    `page_stem` and `page_number` select the page paginated previews show, see PreviewExtension.set_page().
+    """
+    with timings.stage('convert_to_html'):
+        md = _converter_pool.pop() if _converter_pool else create_converter()
+        try:
+            md.preview_extension.set_base_path(base_path)
+            md.preview_extension.set_page(page_stem, page_number)
+            html = md.reset().convert(content)
+            return html, md.Meta
+        finally:
+            _converter_pool.append(md)
 
 def get_filename_without_extension(full_path):
     """Get the filename without extension from a full file path."""
@@ -52,11 +121,38 @@ def get_extension_from_full_path(full_path):
     _, extension = os.path.splitext(file_name_with_extension)
     return extension
     
+# One environment per template directory. Jinja keeps compiled templates in memory,
+# reloads them only when their mtime changes and, with a cache directory, persists
+# their bytecode between builds.
+_template_environments = {}
+
+def get_template_environment(template_dir):
+    """Returns the cached jinja environment of a template directory."""
+    if template_dir not in _template_environments:
+        from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+        bytecode_cache = None
+        if BUILD_OPTIONS['cache_dir']:
+            bytecode_dir = os.path.join(BUILD_OPTIONS['cache_dir'], 'templates')
+            os.makedirs(bytecode_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+        _template_environments[template_dir] = Environment(loader=FileSystemLoader(template_dir), bytecode_cache=bytecode_cache, auto_reload=True)
+    return _template_environments[template_dir]
+
 def fill_template(context, template_path):
     """Fills the HTML template with the given context."""
-    env = Environment(loader=FileSystemLoader(os.path.dirname(template_path)))
-    template = env.get_template(os.path.basename(template_path))
-    return template.render(context)
+    with timings.stage('fill_template'):
+        env = get_template_environment(os.path.dirname(template_path))
+        template = env.get_template(os.path.basename(template_path))
+        return template.render(context)
+
+def write_highlight_css(output_path):
+    """Writes the shared stylesheet used by class based code highlighting."""
+    from highlightCache import get_highlight_stylesheet
+    css_output_dir = os.path.join(output_path, 'static', 'css')
+    os.makedirs(css_output_dir, exist_ok=True)
+    style = setup_codehilite().getConfigs()['pygments_style']
+    with open(os.path.join(css_output_dir, 'highlight.css'), 'w') as f:
+        f.write(get_highlight_stylesheet(style, 'highlight'))
 
 def copy_css_file(css_path, output_path):
     """Copy the CSS file to the output directory."""
@@ -64,13 +160,15 @@ def copy_css_file(css_path, output_path):
     css_output_dir = os.path.join(output_path, 'static', 'css')
     os.makedirs(css_output_dir, exist_ok=True)  # Create the directory if it doesn't exist
     output_css_path = os.path.join(css_output_dir, css_file_name)
-    shutil.copy2(css_path, output_css_path)
+    with timings.stage('copy'):
+        if copy_asset(css_path, output_css_path, BUILD_OPTIONS['copy_mode']):
+            timings.add_bytes(read=os.path.getsize(css_path), written=os.path.getsize(css_path))
 
 def get_dutluk_emoji_href(emoji):
     return f"https://emoji.dutl.uk/png/64x64/{emoji}.png"
 
 
-def get_meta_tags(meta_img_override, meta_title, meta_description, meta_pubdate='', urlroot='', current_dir='', input_path='', output_file_relpath='', meta_canonical_uri_override=None):
+def get_meta_tags(meta_img_override, meta_title, meta_description, meta_pubdate='', urlroot='', current_dir='', input_path='', output_file_relpath='', meta_canonical_uri_override=None, image_map=None):
     current_dir_relpath = os.path.relpath(current_dir, input_path)
 
     canonical_url = os.path.join(urlroot, meta_canonical_uri_override or output_file_relpath)
@@ -79,7 +177,12 @@ def get_meta_tags(meta_img_override, meta_title, meta_description, meta_pubdate=
     if meta_img_override:
         meta_img = meta_img_override
         if meta_img[:4] != 'http':
-            meta_img = os.path.join(urlroot, current_dir_relpath, meta_img)
+            img_relpath = os.path.normpath(os.path.join(current_dir_relpath, meta_img)).replace(os.sep, '/')
+            if image_map and (image_map.get(img_relpath) or {}).get('og'):
+                # Social cards get a resized derivative instead of the original
+                meta_img = os.path.join(urlroot, image_map[img_relpath]['og'])
+            else:
+                meta_img = os.path.join(urlroot, current_dir_relpath, meta_img)
     else:
         meta_img = urlroot + '/static/img/default_img.png'
 
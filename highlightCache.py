@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+import pygments
+from pygments.formatters import HtmlFormatter
+from markdown.extensions import Extension
+from markdown.preprocessors import Preprocessor
+from markdown.extensions.codehilite import CodeHilite
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+from buildTimings import timings
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+MEMORY_ITEMS = 1024
+# Running total of the directory's size: the size prune() last counted, then one line per fragment put() wrote
+SIZE_LEDGER = 'sizes'
+
+class HighlightCache:
+    """Content addressed cache of highlighted code blocks.
+
+    Fragments are keyed by (pygments version, lexer, options, code) and kept in a small
+    in-memory LRU in front of an optional directory of files. The directory is bounded
+    by prune(), which evicts the least recently used fragments first. put() appends the
+    size of every file it writes to a ledger, so prune() only lists the directory when
+    the ledger is missing or says the bound is exceeded.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+
+    def key(self, lang, options, code):
+        payload = json.dumps([pygments.__version__, lang, sorted(options.items()), code], default=repr)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.html')
+
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if not self.directory:
+            return None
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as f:
+                html = f.read()
+        except FileNotFoundError:
+            return None
+        # Touch the file so eviction sees it as recently used
+        os.utime(self.path(key))
+        self.remember(key, html)
+        return html
+
+    def put(self, key, html):
+        self.remember(key, html)
+        if not self.directory:
+            return
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        data = html.encode('utf-8')
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+        self.add_size(len(data))
+
+    def ledger_path(self):
+        return os.path.join(self.directory, SIZE_LEDGER)
+
+    def add_size(self, size):
+        # Appends are atomic for lines this short, so render workers share the ledger
+        try:
+            fd = os.open(self.ledger_path(), os.O_WRONLY | os.O_APPEND)
+        except FileNotFoundError:
+            # Without a ledger prune() counts the directory itself
+            return
+        try:
+            os.write(fd, f'{size}\n'.encode('ascii'))
+        finally:
+            os.close(fd)
+
+    def read_size(self):
+        """Returns the directory's size according to the ledger, None when there is none."""
+        try:
+            with open(self.ledger_path(), 'r', encoding='ascii') as f:
+                return sum(int(line) for line in f if line.strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write_size(self, size):
+        temporary_path = f'{self.ledger_path()}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w', encoding='ascii') as f:
+            f.write(f'{size}\n')
+        os.replace(temporary_path, self.ledger_path())
+
+    def remember(self, key, html):
+        self.memory[key] = html
+        self.memory.move_to_end(key)
+        if len(self.memory) > MEMORY_ITEMS:
+            self.memory.popitem(last=False)
+
+    def highlight(self, code, lang, config):
+        """Returns the html CodeHilite renders for a code block, from the cache when possible."""
+        key = self.key(lang, config, code)
+        html = self.get(key)
+        if html is None:
+            with timings.stage('pygments'):
+                local_config = config.copy()
+                html = CodeHilite(code, lang=lang, style=local_config.pop('pygments_style', 'default'), **local_config).hilite(shebang=False)
+            self.put(key, html)
+        return html
+
+    def prune(self):
+        """Evicts least recently used fragments until the directory is back under its size bound."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        size = self.read_size()
+        if size is not None and size <= self.max_bytes:
+            return
+        files = []
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            for _, size, path in sorted(files):
+                os.remove(path)
+                total -= size
+                if total <= self.max_bytes * 0.8:
+                    break
+        self.write_size(total)
+
+class CachedFencedCodePreprocessor(Preprocessor):
+    """Highlights fenced code blocks through the highlight cache before fenced_code sees them.
+
+    Blocks with an attribute list or hl_lines are left to fenced_code.
+    """
+
+    def __init__(self, md, codehilite, cache):
+        super().__init__(md)
+        self.codehilite = codehilite
+        self.cache = cache
+
+    def run(self, lines):
+        config = self.codehilite.getConfigs()
+        if not config.get('use_pygments', True):
+            return lines
+        text = '\n'.join(lines)
+        index = 0
+        while True:
+            m = FencedBlockPreprocessor.FENCED_BLOCK_RE.search(text, index)
+            if not m:
+                break
+            if m.group('attrs') or m.group('hl_lines'):
+                index = m.end()
+                continue
+            code = self.cache.highlight(m.group('code'), m.group('lang') or None, config)
+            placeholder = self.md.htmlStash.store(code)
+            text = f'{text[:m.start()]}\n{placeholder}\n{text[m.end():]}'
+            index = m.start() + 1 + len(placeholder)
+        return text.split('\n')
+
+class HighlightCacheExtension(Extension):
+    """Markdown extension routing fenced code highlighting through a HighlightCache."""
+
+    def __init__(self, codehilite, cache, **kwargs):
+        super().__init__(**kwargs)
+        self.codehilite = codehilite
+        self.cache = cache
+
+    def extendMarkdown(self, md):
+        # Runs just before fenced_code (priority 25) so cached blocks never reach it
+        md.preprocessors.register(CachedFencedCodePreprocessor(md, self.codehilite, self.cache), 'cached_fenced_code', 26)
+
+_highlight_caches = {}
+
+def get_highlight_cache(cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+    """Returns the process wide highlight cache stored under cache_dir."""
+    key = (cache_dir, max_bytes)
+    if key not in _highlight_caches:
+        directory = os.path.join(cache_dir, 'highlight') if cache_dir else None
+        _highlight_caches[key] = HighlightCache(directory, max_bytes)
+    return _highlight_caches[key]
+
+def get_highlight_stylesheet(style='default', css_class='highlight'):
+    """Returns the stylesheet for class based highlighting."""
+    return HtmlFormatter(style=style).get_style_defs(f'.{css_class}')
@@ -1,30 +1,47 @@
 import os
 import re
-import xml.etree.ElementTree as ET
-from markdown.extensions import Extension
-from markdown.inlinepatterns import Pattern
-from markdown.blockprocessors import BlockProcessor
-from datetime import datetime
+import json
+import hashlib
+from collections import OrderedDict
+from deployManifest import get_source_date
+
+FIRST_TITLE_RE = re.compile(r'(<h[1-6].*?>.+?</h[1-6]>)|#+(\s+(.*?))$', re.MULTILINE | re.IGNORECASE | re.DOTALL)
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+HEADING_MARK_RE = re.compile(r'#+ +')
+PARAGRAPH_RE = re.compile(r'<p>(.*?)</p>', re.DOTALL)
+PARSERS_IGNORE_RE = re.compile(r'<parsers-ignore>.*?</parsers-ignore>')
+INNER_TAG_RE = re.compile(r'<.*?>')
+# Lines an excerpt drops: `@` tags, `!` includes and nested `%` previews, and relative links it re-roots
+EXCERPT_MARKDOWN_RE = re.compile(r'\n[@!%] [^\n]*|(\[.*?\]\()\.')
+# Links are unwrapped and headings demoted in excerpts, since the whole excerpt is itself a link
+EXCERPT_HTML_RE = re.compile(r'<a\b[^>]*>(?P<link>.*?)</a>|<h1\b[^>]*>(?P<title>.*?)</h1>|<h[2-4]\b[^>]*>(?P<heading>.*?)</h[2-4]>')
+PREVIEW_DIRECTIVE_RE = re.compile(r'^%\s*([^>]+)$')
+DEFAULT_PREVIEW_LIMIT = 6
+# Total length of the converted excerpts a build keeps for detailed listings, see ExcerptCache
+EXCERPT_CACHE_CHARS = 2 * 1024 * 1024
+# Front matter patterns of the meta extension (markdown/extensions/meta.py)
+META_BEGIN_RE = re.compile(r'^-{3}(\s.*)?')
+META_END_RE = re.compile(r'^(-{3}|\.{3})(\s.*)?')
+META_RE = re.compile(r'^[ ]{0,3}(?P<key>[A-Za-z0-9_-]+):\s*(?P<value>.*)')
+META_MORE_RE = re.compile(r'^[ ]{4,}(?P<value>.*)')
+# A first level heading without any markup, which markdown outputs as it is
+PLAIN_TITLE_RE = re.compile(r'#[ ]*(?P<title>[^\\`*_{}\[\]<>#&|]+?)[ ]*')
 
 def get_first_title(markdown_or_html_text):
-    pattern = r'(<h[1-6].*?>.+?</h[1-6]>)|#+(\s+(.*?))$'
-    match = re.search(pattern, markdown_or_html_text, re.MULTILINE | re.IGNORECASE | re.DOTALL)
+    match = FIRST_TITLE_RE.search(markdown_or_html_text)
     if match:
-        title = re.sub(r'<[^>]+>', '', match.group(0)).strip() # Strip HTML tags if present
-        title = re.sub(r'#+ +', '', title)
+        title = HTML_TAG_RE.sub('', match.group(0)).strip() # Strip HTML tags if present
+        title = HEADING_MARK_RE.sub('', title)
         return title
     return ""
 
 def extract_first_paragraph(html, character_limit=160):
-    # Find all <p> tags and their inner text
-    p_tags = re.findall(r'<p>(.*?)</p>', html, re.DOTALL)
-
     text_content = ""
-    # Iterate through the extracted <p> tags and construct content
-    for p_content in p_tags:
+    # Iterate through the <p> tags lazily, stopping once the limit is reached
+    for match in PARAGRAPH_RE.finditer(html):
         # Remove inner tags from the paragraph
-        paragraph_text = re.sub(r'<parsers-ignore>.*?</parsers-ignore>', '', p_content)
-        paragraph_text = re.sub(r'<.*?>', '', paragraph_text)
+        paragraph_text = PARSERS_IGNORE_RE.sub('', match.group(1))
+        paragraph_text = INNER_TAG_RE.sub('', paragraph_text)
         paragraph_text = paragraph_text.strip()
 
         text_content += paragraph_text
@@ -33,167 +50,315 @@ def extract_first_paragraph(html, character_limit=160):
 
     return text_content
 
+def parse_preview_directive(directive):
+    """Splits a `%` directive such as `posts:detailed:#tag:page=20` into the directory and its view options.
+
+    The page size is None when the preview is not paginated.
+    """
+    detailed = ':detailed' in directive
+    featured_only = ':featured' in directive
+    tag_filters = re.findall(r':#([\w-]+)', directive)
+    page_size = re.search(r':page=(\d+)', directive)
+    page_size = int(page_size.group(1)) or None if page_size else None
+    directory_name = re.sub(r':(detailed|featured|#[\w-]+|page=\d+)', '', directive).strip()
+    return directory_name, detailed, featured_only, tag_filters, page_size
+
+def find_preview_directives(markdown_text):
+    """Returns the parsed options of every `%` preview directive in a markdown document."""
+    directives = re.findall(r'^%\s*([^>\n]+)$', markdown_text, re.MULTILINE)
+    return [parse_preview_directive(directive) for directive in directives]
+
+def find_preview_directories(markdown_text):
+    """Returns the directory names of every `%` preview directive in a markdown document."""
+    return [directive[0] for directive in find_preview_directives(markdown_text)]
+
+def get_preview_directory_path(base_path, directory_name):
+    return os.path.normpath(os.path.join(base_path, directory_name)) if base_path else directory_name
+
+def count_preview_pages(markdown_text, base_path, processor, preview_limit=DEFAULT_PREVIEW_LIMIT):
+    """Returns the number of pages the paginated previews of a markdown document need, at least 1."""
+    page_count = 1
+    for directory_name, _, featured_only, tag_filters, page_size in find_preview_directives(markdown_text):
+        if page_size:
+            items = preview_index.get_items(get_preview_directory_path(base_path, directory_name), directory_name, preview_limit, processor)
+            item_count = sum(1 for item in items if item.matches(featured_only, tag_filters))
+            page_count = max(page_count, -(-item_count // page_size))
+    return page_count
+
+def select_preview_items(items, page_size=None, page_number=1):
+    """Orders the matching items of a preview newest first and picks a page of them.
+
+    Returns the items shown and the number of pages of the preview, None when it is not paginated.
+    """
+    items = sorted(reversed(items), key=lambda item: item.date, reverse=True)
+    if not page_size:
+        return items, None
+    return items[(page_number - 1) * page_size:page_number * page_size], max(1, -(-len(items) // page_size))
+
+def get_listing_hash(directory_path, directory_name, detailed, featured_only, tag_filters, page_size, page_number, processor, preview_limit=DEFAULT_PREVIEW_LIMIT):
+    """Returns a hash of what a `%` preview shows on one page of a listing.
+
+    Incremental builds re-render a listing when its hash changes, so editing a post only
+    re-renders the listings, and the pages of paginated ones, that show it. Nothing is
+    converted: items are compared by their front matter and excerpt text.
+    """
+    items = [item for item in preview_index.get_items(directory_path, directory_name, preview_limit, processor) if item.matches(featured_only, tag_filters)]
+    items, page_count = select_preview_items(items, page_size, page_number)
+    return hashlib.sha256(json.dumps([page_count] + [item.get_signature(detailed) for item in items]).encode('utf-8')).hexdigest()
+
+def get_site_tags(site_root, processor, preview_limit=DEFAULT_PREVIEW_LIMIT):
+    """Returns the tags used by the posts of a site, which `%` filters can select, with the newest date of each."""
+    tags = {}
+    for item in preview_index.get_items(os.path.normpath(site_root), '..', preview_limit, processor):
+        for tag in {tag.strip() for tag in item.tags}:
+            if re.fullmatch(r'[\w-]+', tag):
+                tags[tag] = max(tags.get(tag, item.date), item.date)
+    return tags
+
+def read_front_matter(markdown_text):
+    """Returns the metadata of markdown text, as the meta extension parses it, and its plain title.
+
+    The title is the text of the heading the document opens with when markdown would output
+    it unchanged, and None otherwise.
+    """
+    meta = {}
+    key = None
+    lines = markdown_text.expandtabs(4).split('\n')
+    if lines and META_BEGIN_RE.match(lines[0]):
+        lines.pop(0)
+    while lines:
+        line = lines.pop(0)
+        if line.strip() == '' or META_END_RE.match(line):
+            break
+        match = META_RE.match(line)
+        if match:
+            key = match.group('key').lower().strip()
+            meta.setdefault(key, []).append(match.group('value').strip())
+            continue
+        match = META_MORE_RE.match(line)
+        if match and key:
+            meta[key].append(match.group('value').strip())
+        else:
+            lines.insert(0, line)
+            break
+
+    # Abbreviation definitions may rewrite the heading's text
+    if '*[' in markdown_text:
+        return meta, None
+    first_line = next((line for line in lines if line.strip()), '')
+    match = PLAIN_TITLE_RE.fullmatch(first_line)
+    return meta, match.group('title') if match else None
+
+class ExcerptCache:
+    """Least recently used converted excerpts of a build, keyed by the hash of their markdown.
+
+    Every detailed listing showing a post, and every page of a paginated one, converts the
+    same excerpt, so converted excerpts are kept until their total length exceeds `max_chars`.
+    """
+
+    def __init__(self, max_chars=EXCERPT_CACHE_CHARS):
+        self.max_chars = max_chars
+        self.excerpts = OrderedDict()
+        self.size = 0
+
+    def clear(self):
+        self.excerpts = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        html = self.excerpts.get(key)
+        if html is not None:
+            self.excerpts.move_to_end(key)
+        return html
+
+    def put(self, key, html):
+        if key in self.excerpts:
+            self.size -= len(self.excerpts.pop(key))
+        self.excerpts[key] = html
+        self.size += len(html)
+        while self.size > self.max_chars:
+            _, evicted = self.excerpts.popitem(last=False)
+            self.size -= len(evicted)
+
+excerpt_cache = ExcerptCache()
+
 class ContentItem:
-    def __init__(self, content, date, href, emoji, tags, title, truncated):
-        self.content = content
+    """A post as previews list it.
+
+    Items keep only what listings show, so an index of many posts costs about as much as
+    their front matter. A detailed listing's `content` comes from the build's excerpt_cache,
+    or reads and converts the excerpt again once it was evicted, and `title` converts it once
+    when the post does not open with a plain heading. `excerpt_hash` identifies the excerpt, see get_signature().
+    """
+
+    __slots__ = ('file_path', 'directory_name', 'relpath', 'preview_limit', 'processor', 'date', 'href', 'emoji', 'tags', 'truncated', 'featured', 'excerpt_hash', 'plain_title', '_title')
+
+    def __init__(self, file_path, directory_name, relpath, preview_limit, processor, date, href, emoji, tags, title, truncated, featured=False, excerpt_hash=None):
+        self.file_path = file_path
+        self.directory_name = directory_name
+        self.relpath = relpath
+        self.preview_limit = preview_limit
+        self.processor = processor
         self.date = date
         self.href = href
         self.emoji = emoji
         self.tags = tags
-        self.title = title
         self.truncated = truncated
-
-class PreviewExtension(Extension):
-    """Markdown extension to handle the special tag for previews."""
-
-    def __init__(self, base_path=None, processor=None, **kwargs):
-        super().__init__(**kwargs)
-        self.config = {
-            'preview_limit': [6, "The number of components to show in the preview"]
-        }
-        self.base_path = base_path
-        self.processor = processor
-
-    def extendMarkdown(self, md):
-        # Define the custom pattern for the special tag
-        pattern = r'%\s*<([^>]+)>'
-        preview_block = PreviewBlockProcessor(self.getConfigs(), md.parser, self.base_path, self.processor)
-        preview_block.md = md
-        md.parser.blockprocessors.register(preview_block, 'preview', 175)
-
-class PreviewBlockProcessor(BlockProcessor):
-    """Block processor for handling the special tag for previews."""
-
-    def __init__(self, config, parser, base_path=None, processor=None):
-        super().__init__(parser)
-        self.directory_name = None
-        self.preview_limit = int(config['preview_limit'])
-        self.base_path = base_path
-        self.processor = processor
-
-    def test(self, parent, block):
-        return re.match(r'^%\s*([^>]+)$', block)
-
-    def run(self, parent, blocks):
-        block = blocks.pop(0)  # Get the special tag line
-        self.directory_name = re.match(r'^%\s*([^>]+)$', block).group(1).strip()
-        content_context = self.get_preview_content()
-        detailed = content_context.get('detailed', False)
-        content_items = content_context.get('content_items', [])
-        content_items = sorted(content_items, key=lambda x: x.date, reverse=True)
-
-        wrapper = ET.Element('div', attrib={'class': 'postsListWrapper'})
-
+        self.featured = featured
+        self.excerpt_hash = excerpt_hash
+        self.plain_title = title
+        self._title = title
+
+    def read_excerpt(self):
+        components, _ = read_excerpt_components(self.file_path, self.preview_limit)
+        return prepare_excerpt(components, self.directory_name, self.relpath)
+
+    @property
+    def content(self):
+        content = excerpt_cache.get(self.excerpt_hash)
+        if content is None:
+            html, _ = self.processor(self.read_excerpt())
+            content = finish_excerpt_html(html)
+            if self.excerpt_hash:
+                excerpt_cache.put(self.excerpt_hash, content)
+        return content
+
+    @property
+    def title(self):
+        if self._title is None:
+            content = self.content
+            self._title = get_first_title(content) or extract_first_paragraph(content)
+        return self._title
+
+    def get_signature(self, detailed):
+        """Returns what a listing shows of the item: its whole excerpt in detailed listings, its title line otherwise."""
         if detailed:
-            for item in content_items:
-                tags_str = ','.join(tag.strip() for tag in item.tags if tag.strip())
-                date_div = ET.Element('div', attrib={'class': 'previewDate'})
-                date_div.text = item.date
-
-                text_div = ET.Element('div')
-                text_div.text = item.content
-
-                a = ET.Element('a', attrib={'href': item.href, 'class': 'previewHref'})
-                a.append(text_div)
-
-                if item.truncated:
-                    read_more = ET.Element('span', attrib={'class': 'a'})
-                    read_more.text = '(Read more)'
-                    a.append(read_more)
-
-                post_wrapper = ET.Element('div', attrib={'class': 'postPreview', 'data-tags': tags_str})
-                post_wrapper.append(date_div)
-                post_wrapper.append(a)
-
-                wrapper.append(post_wrapper)
-
-        else:
-            prev_yr = None
-            for item in content_items:
-                yr = str(item.date.split('-')[0]) if item.date else None
-                tags_str = ','.join(tag.strip() for tag in item.tags if tag.strip())
-
-                post_wrapper = ET.Element('div', attrib={'class': 'postTitle', 'data-tags': tags_str})
-
-                if yr != prev_yr:
-                    date_div = ET.Element('div', attrib={'class': 'dateTab'})
-                    date_div.text = yr
-                    wrapper.append(date_div)
-                    prev_yr = yr
-
-                title_div = ET.Element('div')
-                
-                title_div.text = item.emoji + " " + item.title
-
-                a = ET.Element('a', attrib={'href': item.href})
-                a.append(title_div)
-
-                post_wrapper.append(a)
-                wrapper.append(post_wrapper)
-
-        parent.append(wrapper)
-
-    def get_preview_content(self):
-
-        if not self.directory_name:
-            return {}
-
-        detailed = ':detailed' in self.directory_name
-        featured_only = ':featured' in self.directory_name
-        tag_filters = re.findall(r':#([\w-]+)', self.directory_name)
-        self.directory_name = re.sub(r':(detailed|featured|#[\w-]+)', '', self.directory_name)
-
-        directory_path = os.path.join(self.base_path, self.directory_name) if self.base_path else self.directory_name
-
-        content_items = []
-
-        if os.path.exists(directory_path) and os.path.isdir(directory_path):
-            for root, _, files in sorted(os.walk(directory_path)):
-                files.sort()
-                relpath = os.path.relpath(root, directory_path)
-                for file in files:
-                    href = f"{self.directory_name}/{relpath}/{os.path.splitext(file)[0].replace(', ', '-').replace(' ', '-')}"
-                    href += os.path.splitext(file)[1] if not os.path.splitext(file)[1] == '.md' else '.html'
-                    href = href.replace(".html", "")
-
-                    if file.lower().endswith('.md'):
-                        file_path = os.path.join(root, file)
-                        with open(file_path, 'r') as md_file:
-                            _file_last_modified = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y-%m-%d")
-                            content = md_file.read().strip()
-                            content = content.replace('[TOC]', '')
-                            components = content.split('\n\n')
-                            components = [component for component in components if '<parsers-ignore>' not in component]
-                            truncated = self.preview_limit < len(components)
-                            components = components[:self.preview_limit]
-                            content = '\n\n'.join(components) + '\n\n'
-                            content = re.sub(r'\n@ [^\n]*', '', content, re.MULTILINE) # remove tags
-                            content = re.sub(r'\n! [^\n]*', '', content, re.MULTILINE) # remove includes
-                            content = re.sub(r'\n% [^\n]*', '', content, re.MULTILINE) # remove recursive path calls
-                            content = re.sub(r'(\[.*?\]\()\.', r'\1 ' + self.directory_name + '/' + relpath + '/.', content)
-                            content, meta = self.processor(content)
-                            content = re.sub(r'<a\b[^>]*>(.*?)</a>', r'\1', content)
-                            content = re.sub(r'<h[2-4]\b[^>]*>(.*?)</h[2-4]>', r'<b>\1</b>', content)
-                            content = re.sub(r'<h1\b[^>]*>(.*?)</h1>', r'<div class="preview-title"><h2>\1</h2></div>', content)
-
-                            emoji = meta.get('emoji', ['⏩'])[0]
-                            date = meta.get('date', [_file_last_modified])[0]
-                            tags = meta.get('tags', [''])
-                            title = get_first_title(content) or extract_first_paragraph(content)
-                            is_featured = meta.get('featured', ['false'])[0].lower() == 'true'
-
-                            if featured_only and not is_featured:
-                                continue
-
-                            if tag_filters:
-                                post_tags = {t.strip() for t in tags if t.strip()}
-                                if not all(f in post_tags for f in tag_filters):
-                                    continue
-
-                            content_items.append(ContentItem(content, date, href, emoji, tags, title, truncated))
-
-        return {
-            'content_items': list(reversed(content_items)),
-            'detailed': detailed
-        }
-
+            return [self.href, self.date, self.excerpt_hash, self.truncated]
+        # Titles that are not plain headings come from the converted excerpt
+        return [self.href, self.date, self.emoji, self.tags, self.plain_title if self.plain_title is not None else self.excerpt_hash]
+
+    def matches(self, featured_only=False, tag_filters=()):
+        """Checks the item against the `:featured` and `:#tag` options of a preview. Tags are compared case-insensitively."""
+        if featured_only and not self.featured:
+            return False
+        if tag_filters:
+            post_tags = {t.strip().lower() for t in self.tags if t.strip()}
+            if not all(f.lower() in post_tags for f in tag_filters):
+                return False
+        return True
+
+def read_excerpt_components(file_path, preview_limit, chunk_size=8192):
+    """Returns the first `preview_limit` blank line separated blocks of a post and whether more follow.
+
+    Blocks containing `<parsers-ignore>` are skipped. The file is read in growing chunks
+    only until one more block than needed is complete, so long posts are not read whole.
+    """
+    with open(file_path, 'r') as md_file:
+        text = ''
+        while True:
+            chunk = md_file.read(chunk_size)
+            text += chunk
+            at_end = not chunk
+            components = (text.strip() if at_end else text.lstrip()).replace('[TOC]', '').split('\n\n')
+            if not at_end:
+                # The last block may still grow
+                components.pop()
+            components = [component for component in components if '<parsers-ignore>' not in component]
+            if at_end or len(components) > preview_limit:
+                return components[:preview_limit], preview_limit < len(components)
+            chunk_size *= 2
+
+def prepare_excerpt(components, directory_name, relpath):
+    """Joins excerpt blocks, dropping tag, include and preview lines and re-rooting relative links, in one pass."""
+    link_prefix = f' {directory_name}/{relpath}/.'
+
+    def replace(match):
+        return match.group(1) + link_prefix if match.group(1) is not None else ''
+
+    return EXCERPT_MARKDOWN_RE.sub(replace, '\n\n'.join(components) + '\n\n')
+
+def finish_excerpt_html(html):
+    """Unwraps links and turns the title into a preview title and other headings into bold text, in one pass."""
+    def replace(match):
+        if match.group('link') is not None:
+            return EXCERPT_HTML_RE.sub(replace, match.group('link'))
+        if match.group('title') is not None:
+            return f'<div class="preview-title"><h2>{EXCERPT_HTML_RE.sub(replace, match.group("title"))}</h2></div>'
+        return f'<b>{EXCERPT_HTML_RE.sub(replace, match.group("heading"))}</b>'
+
+    return EXCERPT_HTML_RE.sub(replace, html)
+
+def load_content_item(file_path, href, directory_name, relpath, preview_limit, processor):
+    """Reads a post and builds the preview item shown for it."""
+    components, truncated = read_excerpt_components(file_path, preview_limit)
+    excerpt = prepare_excerpt(components, directory_name, relpath)
+    # No markdown work here and only the front matter is kept, see ContentItem
+    meta, title = read_front_matter(excerpt)
+
+    emoji = meta.get('emoji', ['⏩'])[0]
+    date = meta['date'][0] if 'date' in meta else get_source_date(file_path)
+    tags = meta.get('tags', [''])
+    is_featured = meta.get('featured', ['false'])[0].lower() == 'true'
+
+    excerpt_hash = hashlib.sha256(excerpt.encode('utf-8')).hexdigest()
+    return ContentItem(file_path, directory_name, relpath, preview_limit, processor, date, href, emoji, tags, title, truncated, is_featured, excerpt_hash)
+
+class PreviewIndex:
+    """Shared index of the posts listed by `%` directives.
+
+    Every page previewing the same directory gets the same items, so each post's front
+    matter is read once per build instead of once per page. Items are kept across builds of the
+    same process and reloaded only when their file's size or mtime changes. Each walk of a
+    directory keeps only the items it found, and clear() drops the items of directories the
+    last build did not walk, so removed posts do not stay in memory.
+    """
+
+    def __init__(self):
+        self.directories = {}
+        # Items by (directory_path, directory_name, preview_limit), then by file path
+        self.items = {}
+        self.site_root = None
+
+    def clear(self, site_root=None):
+        """Forgets directory listings and converted excerpts so the next build picks up added, removed and edited posts.
+
+        Previews of `site_root` itself leave out modules and `_` files, which are not published.
+        """
+        self.items = {key: items for key, items in self.items.items() if key in self.directories}
+        self.directories = {}
+        self.site_root = os.path.normpath(site_root) if site_root else None
+        excerpt_cache.clear()
+
+    def get_items(self, directory_path, directory_name, preview_limit, processor):
+        """Returns the unfiltered items of a directory in walk order."""
+        key = (directory_path, directory_name, preview_limit)
+        if key not in self.directories:
+            self.directories[key] = list(self.walk(directory_path, directory_name, preview_limit, processor))
+        return self.directories[key]
+
+    def walk(self, directory_path, directory_name, preview_limit, processor):
+        previous_items = self.items.get((directory_path, directory_name, preview_limit), {})
+        items = self.items[(directory_path, directory_name, preview_limit)] = {}
+        if not (os.path.exists(directory_path) and os.path.isdir(directory_path)):
+            return
+        for root, _, files in sorted(os.walk(directory_path)):
+            files.sort()
+            relpath = os.path.relpath(root, directory_path)
+            for file in files:
+                if not file.lower().endswith('.md'):
+                    continue
+                if directory_path == self.site_root and os.path.normpath(os.path.join(relpath, file)).startswith(('modules' + os.sep, '_')):
+                    continue
+                href = f"{directory_name}/{relpath}/{os.path.splitext(file)[0].replace(', ', '-').replace(' ', '-')}"
+                href += os.path.splitext(file)[1] if not os.path.splitext(file)[1] == '.md' else '.html'
+                href = href.replace(".html", "")
+
+                file_path = os.path.join(root, file)
+                stat = os.stat(file_path)
+                cached = previous_items.get(file_path)
+                if not cached or cached[0] != (stat.st_size, stat.st_mtime_ns):
+                    cached = ((stat.st_size, stat.st_mtime_ns), load_content_item(file_path, href, directory_name, relpath, preview_limit, processor))
+                items[file_path] = cached
+                yield cached[1]
+
+preview_index = PreviewIndex()
@@ -0,0 +1,88 @@
+import os
+import re
+from collections.abc import Mapping
+
+INCLUDE_RE = re.compile(r'\n! include (.+)', re.I)
+
+def find_includes(markdown_text):
+    """Returns the names of the modules a text includes with `! include <name>` lines."""
+    return INCLUDE_RE.findall(markdown_text)
+
+class ModuleGraph(Mapping):
+    """The modules of a site, `modules/<name>.<ext>`, keyed by name.
+
+    Only the module files are listed up front. A module is converted to html the first time
+    it is looked up, by a page's `! include` or a template's `context.modules.<name>`, and
+    kept for later lookups, so modules nothing uses cost nothing. Markdown modules can
+    include other modules; html modules are used as they are. Modules including each other
+    raise ValueError.
+
+    `convert(markdown_text, base_path)` returns the html and meta of a markdown text, as
+    helpers.convert_to_html does. The graph is pickled to render workers, each converting
+    the modules its pages use. Its own state is underscored, as templates look modules up
+    as attributes.
+    """
+
+    def __init__(self, input_path, convert):
+        self._convert = convert
+        self._files = {}
+        for root, _, files in os.walk(os.path.join(input_path, 'modules')):
+            for file in files:
+                self._files[os.path.splitext(file)[0]] = os.path.join(root, file)
+        self._html = {}
+        self._includes = {}
+        self._resolving = []
+
+    def __getitem__(self, name):
+        if name not in self._html:
+            file_path = self._files[name]
+            if name in self._resolving:
+                cycle = self._resolving[self._resolving.index(name):] + [name]
+                raise ValueError(f'Modules include each other: {" -> ".join(cycle)}')
+            self._resolving.append(name)
+            try:
+                with open(file_path, 'r') as f:
+                    content = f.read()
+                if file_path.lower().endswith('.html'):
+                    self._html[name] = content
+                else:
+                    self._html[name], _ = self._convert(self.resolve_includes(content), os.path.dirname(file_path))
+            finally:
+                self._resolving.pop()
+        return self._html[name]
+
+    def __iter__(self):
+        return iter(self._files)
+
+    def __len__(self):
+        return len(self._files)
+
+    def resolve_includes(self, markdown_text):
+        """Replaces the `! include <name>` lines of a text with the html of the modules; unknown modules are dropped."""
+        return INCLUDE_RE.sub(lambda match: self.get(match.group(1), ''), markdown_text)
+
+    def get_includes(self, name):
+        """Returns the names of the modules a module includes directly, reading but not converting it."""
+        if name not in self._includes:
+            file_path = self._files.get(name)
+            if file_path is None or file_path.lower().endswith('.html'):
+                self._includes[name] = []
+            else:
+                with open(file_path, 'r') as f:
+                    self._includes[name] = find_includes(f.read())
+        return self._includes[name]
+
+    def get_dependencies(self, names):
+        """Returns the modules the given ones include, directly or through each other, along with them.
+
+        Names of modules that do not exist are kept, so a page depends on a module it
+        includes before the module is written.
+        """
+        dependencies = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in dependencies:
+                dependencies.add(name)
+                pending.extend(self.get_includes(name))
+        return sorted(dependencies)
@@ -0,0 +1,140 @@
+import os
+import re
+import gzip
+import filecmp
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    # Without brotli only .gz siblings are written
+    brotli = None
+
+FINGERPRINT_LENGTH = 10
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.mjs', '.json', '.xml', '.svg', '.txt', '.map')
+COMPRESSED_EXTENSIONS = ('.gz', '.br')
+# Elements whose whitespace is significant and are left exactly as they are
+PROTECTED_HTML_RE = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.DOTALL | re.IGNORECASE)
+HTML_COMMENT_RE = re.compile(r'<!--(?!\[if|<!|>).*?-->', re.DOTALL)
+# Quoted strings come first in the CSS patterns and are passed through as they are
+CSS_STRING = r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\''
+CSS_COMMENT_RE = re.compile(rf'({CSS_STRING})|/\*.*?\*/', re.DOTALL)
+CSS_WHITESPACE_RE = re.compile(rf'({CSS_STRING})|(\s*;\s*}})\s*|\s*([{{}};,])\s*|\s+')
+
+def fingerprint_path(relpath, digest):
+    """Inserts a content hash before the extension, e.g. `static/css/theme.1a2b3c4d5e.css`."""
+    base, extension = os.path.splitext(relpath)
+    return f'{base}.{digest[:FINGERPRINT_LENGTH]}{extension}'
+
+def minify_html(html):
+    """Strips comments and indentation outside of pre, textarea, script and style elements.
+
+    Whitespace runs are collapsed rather than removed, since between inline elements
+    they are rendered.
+    """
+    parts = PROTECTED_HTML_RE.split(html)
+    minified = []
+    # split() yields text, then the protected element and its tag name for every match
+    for index in range(0, len(parts), 3):
+        text = HTML_COMMENT_RE.sub('', parts[index])
+        text = re.sub(r'[ \t\r\f\v]*\n\s*', '\n', text)
+        text = re.sub(r'[ \t\r\f\v]{2,}', ' ', text)
+        minified.append(text)
+        if index + 1 < len(parts):
+            minified.append(parts[index + 1])
+    return ''.join(minified).strip() + '\n'
+
+def minify_css(css):
+    """Strips comments and the whitespace around braces, semicolons and commas, leaving quoted strings unchanged."""
+    css = CSS_COMMENT_RE.sub(lambda m: m.group(1) or '', css)
+
+    def minify(m):
+        if m.group(1):
+            return m.group(1)
+        if m.group(2):
+            # The last declaration of a block needs no semicolon
+            return '}'
+        return m.group(3) or ' '
+
+    return CSS_WHITESPACE_RE.sub(minify, css).strip()
+
+def write_if_changed(file_path, data):
+    """Writes bytes to a file unless it already holds them, returning whether it wrote."""
+    try:
+        with open(file_path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    # Replace rather than truncate, the old file may be a hardlink to an input
+    temporary_path = f'{file_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(data)
+    os.replace(temporary_path, file_path)
+    return True
+
+def replace_if_changed(temporary_path, file_path):
+    """Moves a written temporary file over a file unless it holds the same bytes, returning whether it replaced it.
+
+    For outputs streamed to disk, which write_if_changed() would need whole in memory.
+    """
+    if os.path.exists(file_path) and filecmp.cmp(temporary_path, file_path, shallow=False):
+        os.remove(temporary_path)
+        return False
+    os.replace(temporary_path, file_path)
+    return True
+
+def write_fingerprinted_css(css_file, output_path, relpath):
+    """Writes a minified, fingerprinted copy of a stylesheet and returns its output relpath."""
+    with open(css_file, 'r', encoding='utf-8') as f:
+        data = minify_css(f.read()).encode('utf-8')
+    fingerprinted_relpath = fingerprint_path(relpath, hashlib.sha256(data).hexdigest())
+    output_file = os.path.join(output_path, fingerprinted_relpath)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    write_if_changed(output_file, data)
+    return fingerprinted_relpath
+
+def compress_file(file_path):
+    """Writes .gz (and, with brotli installed, .br) siblings of a file unless they are up to date."""
+    stat = os.stat(file_path)
+    data = None
+    written = 0
+    encoders = [('.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        encoders.append(('.br', lambda data: brotli.compress(data, quality=11)))
+    for extension, compress in encoders:
+        sibling = file_path + extension
+        try:
+            if os.stat(sibling).st_mtime_ns >= stat.st_mtime_ns:
+                continue
+        except FileNotFoundError:
+            pass
+        if data is None:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+        compressed = compress(data)
+        if len(compressed) < len(data):
+            if write_if_changed(sibling, compressed):
+                written += 1
+            else:
+                # Same content, mark it as up to date with its source
+                os.utime(sibling)
+        elif os.path.exists(sibling):
+            os.remove(sibling)
+    return written
+
+def compress_output(output_path, max_workers=None):
+    """Precompresses every text file of the output.
+
+    Returns the number of compressed files written.
+    """
+    files = []
+    for root, _, names in os.walk(output_path):
+        for name in names:
+            # Build bookkeeping such as the manifest is not served
+            if not name.startswith('.') and name.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+                files.append(os.path.join(root, name))
+    # zlib and brotli release the GIL, so threads compress in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(compress_file, files))
@@ -0,0 +1,287 @@
+import os
+import hashlib
+import tempfile
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+# Elements dropped from the main content shipped in feeds
+STRIPPED_TAGS = {'script', 'style', 'parsers-ignore', 'categorytag'}
+PREFORMATTED_TAGS = {'pre', 'textarea'}
+
+def escape_attribute(value):
+    return escape(value, quote=False).replace('"', '&quot;')
+
+def format_starttag(tag, attrs, self_closing=False):
+    """Serializes a start tag from (name, value) attribute pairs."""
+    parts = [tag] + [name if value is None else f'{name}="{escape_attribute(value)}"' for name, value in attrs]
+    return '<' + ' '.join(parts) + ('/>' if self_closing else '>')
+
+def get_page_url(relpath, urlroot=''):
+    """Returns the public url of an output file, without the `.html` extension."""
+    url = (urlroot + '/' + relpath).replace('\\', '/').lstrip('/')
+    url = url.replace('//', '/')
+    url = url.replace('https:/', 'https://')
+    return url.replace(".html", "")
+
+class SrcLinkRewriter(HTMLParser):
+    """Rewrites `src` attributes (or the given `attributes`) in a single parse, leaving the rest of the document untouched.
+
+    `rewrite_image`, when given, is called with the rewritten attributes of every `<img>`
+    and may return markup replacing the whole tag.
+    """
+
+    def __init__(self, rewrite, rewrite_image=None, attributes=('src',)):
+        super().__init__(convert_charrefs=False)
+        self.rewrite = rewrite
+        self.rewrite_image = rewrite_image
+        self.attributes = attributes
+        self.replacements = []
+        self.line_offsets = [0]
+
+    def rewrite_document(self, html_content):
+        # HTMLParser reports positions as (line, column) with lines split on '\n' only
+        for line in html_content.split('\n'):
+            self.line_offsets.append(self.line_offsets[-1] + len(line) + 1)
+        self.feed(html_content)
+        self.close()
+
+        # Splice the rewritten tags into the original text
+        pieces, position = [], 0
+        for start, length, tag_text in self.replacements:
+            pieces.append(html_content[position:start])
+            pieces.append(tag_text)
+            position = start + length
+        pieces.append(html_content[position:])
+        return ''.join(pieces)
+
+    def handle_starttag(self, tag, attrs):
+        self.rewrite_tag(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self.rewrite_tag(tag, attrs, True)
+
+    def rewrite_tag(self, tag, attrs, self_closing):
+        new_attrs = [(name, self.rewrite(value) if name in self.attributes and value is not None else value) for name, value in attrs]
+        markup = self.rewrite_image(new_attrs, self_closing) if tag == 'img' and self.rewrite_image else None
+        if markup is None:
+            if new_attrs == attrs:
+                return
+            markup = format_starttag(tag, new_attrs, self_closing)
+        line, column = self.getpos()
+        start = self.line_offsets[line - 1] + column
+        self.replacements.append((start, len(self.get_starttag_text()), markup))
+
+def rewrite_src_links(html_content, rewrite, rewrite_image=None, attributes=('src',)):
+    """Replaces every `src` attribute value with `rewrite(value)`, and `<img>` tags with `rewrite_image(attrs, self_closing)` when it returns markup."""
+    return SrcLinkRewriter(rewrite, rewrite_image, attributes).rewrite_document(html_content)
+
+def relocate_relative_links(html_content, prefix):
+    """Prefixes the relative `href` and `src` links of a page written to another directory than its source's."""
+    def relocate(url):
+        if not url or url.startswith(('/', '#', '?')) or urlsplit(url).scheme:
+            return url
+        return f'{prefix}/{url}'
+
+    return rewrite_src_links(html_content, relocate, attributes=('href', 'src'))
+
+class PageRecordParser(HTMLParser):
+    """Collects a rendered page's metadata and cleaned `<main>` content in one pass."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = None
+        self.canonical = None
+        self.date = None
+        self.description = None
+        self.tags = []
+        self.in_title = False
+        self.category_text = None
+        self.main_depth = 0
+        self.main_done = False
+        self.skip_depth = 0
+        self.preformatted_depth = 0
+        self.main = []
+
+    def in_main(self):
+        return self.main_depth > 0 and not self.main_done
+
+    def handle_starttag(self, tag, attrs):
+        self.collect_metadata(tag, dict(attrs))
+        if tag == 'main' and not self.main_done:
+            self.main_depth += 1
+        if self.in_main():
+            self.emit_starttag(tag, attrs, tag in VOID_TAGS)
+
+    def handle_startendtag(self, tag, attrs):
+        self.collect_metadata(tag, dict(attrs))
+        if self.in_main():
+            self.emit_starttag(tag, attrs, True)
+            if tag in STRIPPED_TAGS:
+                self.skip_depth -= 1
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self.in_title = False
+        elif tag == 'categorytag' and self.category_text is not None:
+            self.tags.append(''.join(self.category_text).strip())
+            self.category_text = None
+
+        if not self.in_main():
+            return
+        if tag in STRIPPED_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif not self.skip_depth and tag not in VOID_TAGS:
+            self.main.append(f'</{tag}>')
+            if tag in PREFORMATTED_TAGS:
+                self.preformatted_depth = max(0, self.preformatted_depth - 1)
+        if tag == 'main':
+            self.main_depth -= 1
+            self.main_done = self.main_depth == 0
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+        if self.category_text is not None:
+            self.category_text.append(data)
+        if self.in_main() and not self.skip_depth:
+            if not self.preformatted_depth and not data.strip():
+                # Indentation between tags is collapsed to a single newline or space
+                data = '\n' if '\n' in data else ' '
+            self.main.append(escape(data, quote=False))
+
+    def handle_comment(self, data):
+        if self.in_main() and not self.skip_depth:
+            self.main.append(f'<!--{data}-->')
+
+    def collect_metadata(self, tag, attrs):
+        if tag == 'title' and self.title is None:
+            self.title = ''
+            self.in_title = True
+        elif tag == 'link' and 'canonical' in (attrs.get('rel') or '').split() and self.canonical is None:
+            self.canonical = attrs.get('href')
+        elif tag == 'meta' and attrs.get('name') in ('pubDate', 'pubdate') and self.date is None:
+            self.date = attrs.get('content')
+        elif tag == 'meta' and attrs.get('name') == 'description' and self.description is None:
+            self.description = attrs.get('content')
+        elif tag == 'categorytag':
+            self.category_text = []
+
+    def emit_starttag(self, tag, attrs, self_closing):
+        if tag in STRIPPED_TAGS:
+            self.skip_depth += 1
+            return
+        if self.skip_depth:
+            return
+        attrs = [(name, value) for name, value in attrs if name != 'style']
+        if tag == 'img':
+            attrs.append(('style', 'max-width:100%;'))
+        self.main.append(format_starttag(tag, attrs, self_closing))
+        if tag in PREFORMATTED_TAGS and not self_closing:
+            self.preformatted_depth += 1
+
+def extract_page_record(html_content):
+    """Parses a rendered page into a record of its title, canonical url, date, tags, description and main content."""
+    parser = PageRecordParser()
+    parser.feed(html_content)
+    parser.close()
+    return {
+        'title': parser.title,
+        'canonical': parser.canonical,
+        'date': parser.date,
+        'tags': parser.tags,
+        'description': parser.description,
+        'content': ''.join(parser.main) if parser.main_depth or parser.main_done else None,
+    }
+
+class ContentSpool:
+    """The main contents of page records, kept in a temporary file instead of in memory.
+
+    A site's records live until its sitemap, feeds and search index are written, and their
+    contents would make up most of a large build's memory. Spooled records carry the
+    `spooled` (offset, length) of their content instead, read back by get_page_content().
+
+    With a `path`, the spool is a file kept between builds: the first write starts it over,
+    and a spool that was only read from reads the file a previous build left. A digest of
+    every content written is kept, see get_digest(), so contents can be compared without
+    reading them back.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.file = None
+        self.size = 0
+        self.digests = {}
+
+    def clear(self):
+        """Closes the spool; the contents of a temporary spool are dropped and can no longer be read."""
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.size = 0
+        self.digests = {}
+
+    def write(self, content):
+        if self.file is None:
+            self.file = open(self.path, 'w+b') if self.path else tempfile.TemporaryFile()
+        data = content.encode('utf-8')
+        self.file.seek(self.size)
+        self.file.write(data)
+        self.digests[self.size] = hashlib.blake2b(data, digest_size=16).digest()
+        offset, self.size = self.size, self.size + len(data)
+        return offset, len(data)
+
+    def get_digest(self, offset, length):
+        """Returns the digest of a content written to the spool in this build."""
+        return self.digests[offset]
+
+    def read(self, offset, length):
+        if self.file is None:
+            self.file = open(self.path, 'rb')
+        self.file.seek(offset)
+        return self.file.read(length).decode('utf-8')
+
+    def spool(self, page):
+        """Moves a record's content to the spool, returning the record."""
+        if page.get('content') is not None:
+            page['spooled'] = self.write(page.pop('content'))
+        return page
+
+# Contents of the records of the current build, see render.process_directory
+content_spool = ContentSpool()
+
+def has_content(page):
+    """Tells whether a record carries its content, in memory or spooled, rather than needing its output file parsed."""
+    return 'content' in page or 'spooled' in page
+
+def get_page_content(page, root_directory):
+    """Returns a record's main content, reading it back from the output file if the record has none.
+
+    Contents read back are spooled, so feeds listing a page more than once parse it once.
+    """
+    if not has_content(page):
+        with open(os.path.join(root_directory, page['path']), 'r', encoding='utf-8') as file:
+            page['content'] = extract_page_record(file.read())['content']
+        content_spool.spool(page)
+    if 'spooled' in page:
+        return content_spool.read(*page['spooled'])
+    return page['content']
+
+def iter_html_files(directory):
+    """Yields the html files of a directory as the walk finds them."""
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.lower().endswith('.html'):
+                yield os.path.join(root, file)
+
+def read_page_records(root_directory, urlroot=''):
+    """Yields a page record for every html file found in an output directory, its content spooled."""
+    for file_path in iter_html_files(root_directory):
+        with open(file_path, 'r', encoding='utf-8') as file:
+            record = extract_page_record(file.read())
+        relpath = os.path.relpath(file_path, root_directory)
+        record['path'] = relpath
+        record['url'] = get_page_url(relpath, urlroot)
+        record['mtime'] = os.path.getmtime(file_path)
+        yield content_spool.spool(record)
@@ -0,0 +1,166 @@
+import xml.etree.ElementTree as ET
+from markdown.extensions import Extension
+from markdown.blockprocessors import BlockProcessor
+from buildTimings import timings
+from markdownTags import PREVIEW_DIRECTIVE_RE, parse_preview_directive, get_preview_directory_path, select_preview_items, preview_index
+
+class PreviewExtension(Extension):
+    """Markdown extension to handle the special tag for previews."""
+
+    def __init__(self, base_path=None, processor=None, **kwargs):
+        super().__init__(**kwargs)
+        self.config = {
+            'preview_limit': [6, "The number of components to show in the preview"]
+        }
+        self.base_path = base_path
+        self.processor = processor
+        self.preview_block = None
+        self.page_stem = None
+        self.page_number = 1
+
+    def extendMarkdown(self, md):
+        # Define the custom pattern for the special tag
+        pattern = r'%\s*<([^>]+)>'
+        preview_block = PreviewBlockProcessor(self.getConfigs(), md.parser, self.base_path, self.processor)
+        preview_block.md = md
+        preview_block.page_stem = self.page_stem
+        preview_block.page_number = self.page_number
+        md.parser.blockprocessors.register(preview_block, 'preview', 175)
+        md.preview_extension = self
+        self.preview_block = preview_block
+
+    def set_base_path(self, base_path):
+        """Points `%` directives at a new directory so a converter can be reused for another page."""
+        self.base_path = base_path
+        if self.preview_block:
+            self.preview_block.base_path = base_path
+
+    def set_page(self, page_stem=None, page_number=1):
+        """Selects the page paginated previews show; `page_stem` is the file name, without extension, of the page's first page."""
+        self.page_stem = page_stem
+        self.page_number = page_number
+        if self.preview_block:
+            self.preview_block.page_stem = page_stem
+            self.preview_block.page_number = page_number
+
+class PreviewBlockProcessor(BlockProcessor):
+    """Block processor for handling the special tag for previews."""
+
+    def __init__(self, config, parser, base_path=None, processor=None):
+        super().__init__(parser)
+        self.directory_name = None
+        self.preview_limit = int(config['preview_limit'])
+        self.base_path = base_path
+        self.processor = processor
+        self.page_stem = None
+        self.page_number = 1
+
+    def test(self, parent, block):
+        return PREVIEW_DIRECTIVE_RE.match(block)
+
+    def run(self, parent, blocks):
+        with timings.stage('preview'):
+            self.render_preview(parent, blocks)
+
+    def render_preview(self, parent, blocks):
+        block = blocks.pop(0)  # Get the special tag line
+        self.directory_name = PREVIEW_DIRECTIVE_RE.match(block).group(1).strip()
+        content_context = self.get_preview_content()
+        detailed = content_context.get('detailed', False)
+        page_size = content_context.get('page_size')
+        content_items, page_count = select_preview_items(content_context.get('content_items', []), page_size, self.page_number)
+
+        wrapper = ET.Element('div', attrib={'class': 'postsListWrapper'})
+
+        if detailed:
+            for item in content_items:
+                tags_str = ','.join(tag.strip() for tag in item.tags if tag.strip())
+                date_div = ET.Element('div', attrib={'class': 'previewDate'})
+                date_div.text = item.date
+
+                text_div = ET.Element('div')
+                text_div.text = item.content
+
+                a = ET.Element('a', attrib={'href': item.href, 'class': 'previewHref'})
+                a.append(text_div)
+
+                if item.truncated:
+                    read_more = ET.Element('span', attrib={'class': 'a'})
+                    read_more.text = '(Read more)'
+                    a.append(read_more)
+
+                post_wrapper = ET.Element('div', attrib={'class': 'postPreview', 'data-tags': tags_str})
+                post_wrapper.append(date_div)
+                post_wrapper.append(a)
+
+                wrapper.append(post_wrapper)
+
+        else:
+            prev_yr = None
+            for item in content_items:
+                yr = str(item.date.split('-')[0]) if item.date else None
+                tags_str = ','.join(tag.strip() for tag in item.tags if tag.strip())
+
+                post_wrapper = ET.Element('div', attrib={'class': 'postTitle', 'data-tags': tags_str})
+
+                if yr != prev_yr:
+                    date_div = ET.Element('div', attrib={'class': 'dateTab'})
+                    date_div.text = yr
+                    wrapper.append(date_div)
+                    prev_yr = yr
+
+                title_div = ET.Element('div')
+                
+                title_div.text = item.emoji + " " + item.title
+
+                a = ET.Element('a', attrib={'href': item.href})
+                a.append(title_div)
+
+                post_wrapper.append(a)
+                wrapper.append(post_wrapper)
+
+        # A page past this preview's last page shows no navigation, as other previews of the page have more pages
+        if page_size and 1 < page_count and self.page_number <= page_count:
+            wrapper.append(self.get_pagination(page_count))
+
+        parent.append(wrapper)
+
+    def get_page_href(self, page_number):
+        """Returns the link to a page of this page, relative to its first page's directory like item links."""
+        return self.page_stem if page_number == 1 else f'{self.page_stem}/page/{page_number}'
+
+    def get_pagination(self, page_count):
+        nav = ET.Element('nav', attrib={'class': 'pagination'})
+        if self.page_number > 1:
+            newer = ET.SubElement(nav, 'a', attrib={'href': self.get_page_href(self.page_number - 1), 'class': 'newerPosts', 'rel': 'prev'})
+            newer.text = 'Newer posts'
+        position = ET.SubElement(nav, 'span', attrib={'class': 'pageNumber'})
+        position.text = f'Page {self.page_number} of {page_count}'
+        if self.page_number < page_count:
+            older = ET.SubElement(nav, 'a', attrib={'href': self.get_page_href(self.page_number + 1), 'class': 'olderPosts', 'rel': 'next'})
+            older.text = 'Older posts'
+        return nav
+
+    def get_preview_content(self):
+
+        if not self.directory_name:
+            return {}
+
+        self.directory_name, detailed, featured_only, tag_filters, page_size = parse_preview_directive(self.directory_name)
+        if not self.page_stem:
+            # Pages are only known for the page being rendered, not for excerpts or modules
+            page_size = None
+
+        directory_path = get_preview_directory_path(self.base_path, self.directory_name)
+
+        content_items = [
+            item for item in preview_index.get_items(directory_path, self.directory_name, self.preview_limit, self.processor)
+            if item.matches(featured_only, tag_filters)
+        ]
+
+        return {
+            'content_items': content_items,
+            'detailed': detailed,
+            'page_size': page_size,
+        }
+
@@ -1,86 +1,139 @@
 import os
 import re
+import sys
+import json
 import argparse
 
-from generateSitemap import generate_sitemap
-from generateRSS import generate_rss_feed
+from searchIndex import generate_search_index, SEARCH_DIRECTORY
+from buildTimings import timings
+from deployManifest import DeployManifest, get_source_time, get_source_date
+from buildShards import parse_shard, is_in_shard, read_shard_records
+from assetPipeline import contains_marker, copy_assets
+from outputOptimizer import fingerprint_path, minify_html, write_fingerprinted_css, compress_output
+from buildManifest import hash_file
+from moduleGraph import ModuleGraph, find_includes
 from helpers import *
-from bs4 import BeautifulSoup
+from markdownTags import find_preview_directives, get_preview_directory_path, count_preview_pages, get_site_tags, preview_index
+from pageRecords import rewrite_src_links, relocate_relative_links, extract_page_record, get_page_url, content_spool
 from urllib.parse import urljoin
 
 def find_modules(directory):
-    """Finds and returns a dictionary containing module filenames and their content."""
-    module_dict = {}
-    modules_dir = os.path.join(directory, 'modules')
-    
-    if not os.path.exists(modules_dir):
-        return module_dict
-    
-    for root, _, files in os.walk(modules_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            filename, extension = get_filename_without_extension(file), get_extension_from_full_path(file)
-            if extension == 'html':
-                with open(file_path, 'r') as f:
-                    module_dict[filename] = f.read()
-            else:
-                module_dict[filename], _ = convert_to_html(read_file_content(file_path), os.path.dirname(file_path))
-    return module_dict
+    """Returns the module graph of a site; modules are converted when pages and templates first use them."""
+    return ModuleGraph(directory, convert_to_html)
+
+def find_template_modules(template_dir):
+    """Returns the names of the modules the templates of a directory reference, e.g. `context.modules.navbar`."""
+    names = set()
+    for file in sorted(os.listdir(template_dir)):
+        file_path = os.path.join(template_dir, file)
+        if os.path.isfile(file_path):
+            matches = re.findall(r'modules(?:\.(\w+)|\[[\'"](\w+)[\'"]\])', read_file_content(file_path))
+            names.update(attribute or key for attribute, key in matches)
+    return sorted(names)
+
+def get_html_output_path(output_file):
+    """Maps an output path of a markdown source to the path of its rendered html page."""
+    return os.path.splitext(output_file)[0].replace(', ', '-').replace(' ', '-') + '.html'
+
+def get_paginated_output_path(html_output_file, page_number):
+    """Maps the first page of a page with paginated previews to its other pages, e.g. `blog.html` to `blog/page/2.html`."""
+    if page_number == 1:
+        return html_output_file
+    return os.path.join(os.path.splitext(html_output_file)[0], 'page', f'{page_number}.html')
 
-def replace_relative_src_links(html_content, reldir, root_url):
+def get_tag_page_content(tag, date):
+    """Returns the markdown of the generated index page of a tag, which lives in `tags/` and lists the tagged posts of the whole site."""
+    return f'---\ndate: {date}\n---\n\n# #{tag}\n\n% ..:#{tag}\n'
+
+def replace_relative_src_links(html_content, reldir, root_url, asset_map=None, image_map=None, responsive_images=None):
     # Ensure root_url does not end with a slash
     root_url = root_url.rstrip('/')
     reldir = reldir.lstrip('/').rstrip('/')
-    
-    # Parse the HTML content
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    # Find all elements with a src attribute
-    for tag in soup.find_all(src=True):
-        src = tag['src']
-        
+    prefix = root_url + '/'
+    # Rewritten urls of the images that have resized derivatives
+    responsive_urls = {}
+
+    def fingerprint(url):
+        relpath = url[len(prefix):] if url.startswith(prefix) else None
+        # Point links to static files at their fingerprinted copies
+        new_url = prefix + asset_map[relpath] if asset_map and relpath in asset_map else url
+        if image_map and relpath in image_map:
+            responsive_urls[new_url] = image_map[relpath]
+        return new_url
+
+    def rewrite_image(attrs, self_closing):
+        entry = responsive_urls.get(dict(attrs).get('src'))
+        if entry is None:
+            return None
+        return responsive_images.get_markup(entry, attrs, self_closing, lambda relpath: prefix + relpath)
+
+    def rewrite(src):
         # Check if the src is a relative path (does not start with http://, https://, or /)
         if not src.startswith(('http://', 'https://', '/')):
             # Construct the new src value
-            new_src = urljoin(f'{root_url}/{reldir}/', src)
-            tag['src'] = new_src
+            return fingerprint(urljoin(f'{root_url}/{reldir}/', src))
         elif src.startswith('/'):
             # Handle absolute paths relative to the root URL
-            src = src.lstrip('/')
-            new_src = urljoin(root_url, src)
-            tag['src'] = new_src
-    
-    # Return the modified HTML content as a string
-    return str(soup)
+            return fingerprint(urljoin(root_url, src.lstrip('/')))
+        return src
+
+    # Rewrite the src attributes in a single event-based pass over the HTML content
+    return rewrite_src_links(html_content, rewrite, rewrite_image if image_map and responsive_images else None)
 
-def process_markdown_file(input_path, file_path, output_file_, module_dict, root, urlroot, favicon, website_title, template_path, output_path):
-    """Processes a Markdown file, converts it to HTML, and fills in the template."""
-    content = read_file_content(file_path)
+def get_asset_url(relpath, urlroot, asset_map=None):
+    """Returns the url of an output file, fingerprinted when the build has an asset map."""
+    return f"{urlroot}/{(asset_map or {}).get(relpath, relpath)}"
+
+def process_markdown_file(input_path, file_path, output_file_, module_dict, root, urlroot, favicon, website_title, template_path, output_path, asset_map=None, image_map=None, responsive_images=None, page_number=1, content=None):
+    """Processes a Markdown file, converts it to HTML, and fills in the template.
+
+    Pages after the first of a page with paginated previews are written under `<name>/page/`.
+    `content` stands in for the file's content for generated pages, which have no source file.
+    """
+    is_generated = content is not None
+    if not is_generated:
+        with timings.stage('read'):
+            content = read_file_content(file_path)
+            timings.add_bytes(read=os.path.getsize(file_path))
     # If no title, use content.
     title = get_first_title(content) or extract_first_paragraph(content, character_limit=50)
     
     # Change the file extension to '.html'
-    output_file = os.path.splitext(output_file_)[0].replace(', ', '-').replace(' ', '-') + '.html'
+    first_page_file = get_html_output_path(output_file_)
+    page_stem = os.path.splitext(os.path.basename(first_page_file))[0]
+    output_file = get_paginated_output_path(first_page_file, page_number)
     output_file_relpath = os.path.relpath(output_file, output_path)
-    output_dir_relpath = os.path.dirname(output_file_relpath)
+    # Relative links are resolved against the source's directory, wherever the page is written
+    output_dir_relpath = os.path.dirname(os.path.relpath(first_page_file, output_path))
+
+    # Record what the page is built from so incremental builds know when to re-render it
+    included_modules = module_dict.get_dependencies(find_includes(content))
+    # A listing depends on the posts it shows on this page, see markdownTags.get_listing_hash()
+    preview_listings = [
+        [os.path.relpath(get_preview_directory_path(os.path.dirname(file_path), directory_name), input_path), directory_name, detailed, featured_only, tag_filters, page_size, page_number]
+        for directory_name, detailed, featured_only, tag_filters, page_size in find_preview_directives(content)
+    ]
     
     # Replace module tags in the content
-    content = re.sub('\n! include (.+)', lambda match: module_dict.get(match.group(1), ""), content, flags=re.I)
-    content, meta = convert_to_html(content, os.path.dirname(file_path))
-    content = replace_relative_src_links(content, output_dir_relpath, urlroot)
+    content = module_dict.resolve_includes(content)
+    content, meta = convert_to_html(content, os.path.dirname(file_path), page_stem, page_number)
+    with timings.stage('replace_relative_src_links'):
+        content = replace_relative_src_links(content, output_dir_relpath, urlroot, asset_map, image_map, responsive_images)
 
     meta_img_override = meta.get('image', [None])[0]
     meta_title = meta.get('title', [title])[0]
     meta_description = meta.get('description', [extract_first_paragraph(content)])[0]
     meta_canonical_uri = meta.get('canonical_uri', [None])[0]
-    meta_date = meta.get('date', [datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y-%m-%d")])[0]
+    meta_date = meta['date'][0] if 'date' in meta else get_source_date(file_path)
 
-    meta_tags = get_meta_tags(meta_img_override, meta_title, meta_description, meta_date, urlroot, root, input_path, output_file_relpath, meta_canonical_uri)
+    meta_tags = get_meta_tags(meta_img_override, meta_title, meta_description, meta_date, urlroot, root, input_path, output_file_relpath, meta_canonical_uri, image_map)
 
     meta_lang = meta.get('language', ['en'])[0]
 
     category_tags = meta.get('tags', [])
 
+    if page_number > 1:
+        meta_title = f"{meta_title} - Page {page_number}"
     meta_title = f"{meta_title} - {website_title}"
 
     # Fill in the template with the context information
@@ -92,22 +145,140 @@ def process_markdown_file(input_path, file_path, output_file_, module_dict, root
         'modules': module_dict,
         'content': content,
         'meta_tags': meta_tags,
-        'category_tags': category_tags
+        'category_tags': category_tags,
+        'theme_css': get_asset_url('static/css/theme.css', urlroot, asset_map),
+        'highlight_css': get_asset_url('static/css/highlight.css', urlroot, asset_map) if BUILD_OPTIONS['highlight_classes'] else None,
+        'search_js': get_asset_url(f'{SEARCH_DIRECTORY}/search.js', urlroot) if BUILD_OPTIONS['search'] else None,
     }
+    # Pages can pick another template of the template directory with a `layout` meta entry
+    layout = meta.get('layout', [None])[0]
+    if layout:
+        template_path = os.path.join(os.path.dirname(template_path), layout)
     filled_template = fill_template({'context': context}, template_path)
+    if page_number > 1:
+        filled_template = relocate_relative_links(filled_template, os.path.relpath(os.path.dirname(first_page_file), os.path.dirname(output_file)))
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with timings.stage('write'), open(output_file, 'w') as f:
+        f.write(minify_html(filled_template) if BUILD_OPTIONS['optimize'] else filled_template)
+        timings.add_bytes(written=f.tell())
+
+    # Capture what the sitemap and RSS feed need while the page is still in memory
+    with timings.stage('extract_page_record'):
+        page = extract_page_record(filled_template)
+    page.update({
+        'source': os.path.relpath(file_path, input_path),
+        'path': output_file_relpath,
+        'url': get_page_url(output_file_relpath, urlroot),
+        'dependencies': [f'module:{name}' for name in included_modules] + [f'listing:{json.dumps(listing)}' for listing in preview_listings],
+    })
+    if is_generated or page_number > 1:
+        # Pages generated by the build, tag pages and the later pages of listings, get no per-directory feed
+        page['generated'] = True
+    return page
+
+_worker_module_dict = None
+_worker_asset_map = None
+_worker_image_map = None
+_worker_responsive_images = None
+
+def _init_render_worker(module_dict, asset_map, image_map, responsive_images, build_options, site_root):
+    """Keeps the build's modules, asset names and images in the worker process so they are sent once per worker, not per page."""
+    global _worker_module_dict, _worker_asset_map, _worker_image_map, _worker_responsive_images
+    _worker_module_dict = module_dict
+    _worker_asset_map = asset_map
+    _worker_image_map = image_map
+    _worker_responsive_images = responsive_images
+    configure(**build_options)
+    preview_index.clear(site_root)
+    # Forked workers start with a copy of the parent's timings
+    timings.reset()
+
+def render_page(module_dict, asset_map, image_map, responsive_images, page_args):
+    # Timed by output, since every page of a paginated listing renders the same source
+    output_file = get_paginated_output_path(get_html_output_path(page_args['output_file_']), page_args.get('page_number', 1))
+    with timings.page(os.path.relpath(output_file, page_args['output_path'])):
+        return process_markdown_file(module_dict=module_dict, asset_map=asset_map, image_map=image_map, responsive_images=responsive_images, **page_args)
 
-    with open(output_file, 'w') as f:
-        f.write(filled_template)
+def _render_page(page_args):
+    page = render_page(_worker_module_dict, _worker_asset_map, _worker_image_map, _worker_responsive_images, page_args)
+    # A worker's timings travel back with each page and are merged into the parent's
+    return page, timings.take()
 
+def render_pages(pages_args, module_dict, jobs=1, asset_map=None, image_map=None, responsive_images=None):
+    """Renders pages and yields their results in input order, using a process pool when jobs > 1."""
+    if jobs <= 1 or len(pages_args) <= 1:
+        for page_args in pages_args:
+            yield render_page(module_dict, asset_map, image_map, responsive_images, page_args)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    # Results (and the first failure) are reported in walk order regardless of which worker finishes first
+    chunksize = max(1, len(pages_args) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_render_worker, initargs=(module_dict, asset_map, image_map, responsive_images, BUILD_OPTIONS, pages_args[0]['input_path'])) as executor:
+        for page, page_timings in executor.map(_render_page, pages_args, chunksize=chunksize):
+            timings.merge(page_timings)
+            yield page
+
+def process_directory(input_path, output_path, css, template_path, favicon, urlroot, website_title, manifest=None, jobs=1, tag_pages=False, shard=None):
+    """Processes the input directory and saves the files in the output directory.
+
+    When a `BuildManifest` is given, outputs whose recorded dependencies are unchanged are
+    skipped and outputs whose sources were removed are deleted. Pages are rendered on
+    `jobs` processes. With `tag_pages`, an index page listing the posts of every tag is
+    generated under `tags/`. With a `shard` (i, N), only the pages and files whose sources
+    hash to shard i of N are published, see buildShards.get_shard().
+
+    Returns a record for every published html page, in walk order, with its path, url,
+    canonical url, title, date, tags, description and main content. Contents are spooled
+    to a temporary file as pages are written, see pageRecords.ContentSpool, and read with
+    pageRecords.get_page_content() until the next build. Pages skipped by an incremental
+    build get their content from the manifest's contents file; only when the manifest
+    has none is it read back from the output file, if a consumer needs it.
+
+    The walk is not streamed into rendering: asset fingerprints, image derivatives and tag
+    pages need every file of the site before the first page renders, so a work item per
+    page and static file is kept until the pages are rendered.
+    """
+    css_output_relpath = os.path.join('static', 'css', 'theme.css')
+    preview_index.clear(input_path)
+    content_spool.clear()
+    if manifest:
+        manifest.start_build()
+    with timings.stage('find_modules'):
+        module_dict = find_modules(input_path)
+    template_modules = module_dict.get_dependencies(find_template_modules(os.path.dirname(template_path) or '.'))
+    page_dependencies = ['config', 'template'] + [f'module:{name}' for name in template_modules]
 
-def process_directory(input_path, output_path, css, template_path, favicon, urlroot, website_title):
-    """Processes the input directory and saves the files in the output directory."""
     # Copy the CSS file to the output directory
-    copy_css_file(css, output_path)
+    if manifest and manifest.is_fresh(css_output_relpath, output_path):
+        manifest.keep(css_output_relpath)
+    else:
+        copy_css_file(css, output_path)
+        if manifest:
+            manifest.record(css_output_relpath, css, ['css'])
+
+    if BUILD_OPTIONS['highlight_classes']:
+        highlight_css_relpath = os.path.join('static', 'css', 'highlight.css')
+        if manifest and manifest.is_fresh(highlight_css_relpath, output_path):
+            manifest.keep(highlight_css_relpath)
+        else:
+            write_highlight_css(output_path)
+            if manifest:
+                manifest.record(highlight_css_relpath, None, ['config'])
 
-    module_dict = find_modules(input_path)
+    # Page records in walk order; pages to render hold a placeholder until they are
+    pages = []
+    queued_pages = []
+    # (source, destination) pairs of the files published as they are, and the non-html ones among them
+    assets = []
+    static_files = []
 
     for root, dirs, files in os.walk(input_path):
+        if BUILD_OPTIONS['reproducible']:
+            # Page records, and so the sitemap and feeds, follow the walk
+            dirs.sort()
+            files.sort()
         for dir_name in dirs:
             input_dir = os.path.join(root, dir_name)
             output_dir = input_dir.replace(input_path, output_path)
@@ -119,31 +290,291 @@ def process_directory(input_path, output_path, css, template_path, favicon, urlr
             output_file = os.path.join(output_path, relative_path)
 
             if relative_path.startswith('modules/') or relative_path.startswith('_'):
-                # For files in 'modules', already handled in find_modules()
+                # Modules are only published through the pages and templates including them
                 continue
 
-            if file.lower().endswith(('.md')) or (file.lower().endswith(('.html')) and '<convertsm>' in open(file_path).read()) :
-                # If the file is markdown, convert to HTML and replace module tags
-                process_markdown_file(input_path, file_path, output_file, module_dict, root, urlroot, favicon, website_title, template_path, output_path)
+            is_html = file.lower().endswith(('.html'))
+
+            if file.lower().endswith(('.md')) or (is_html and contains_marker(file_path)):
+                if not is_in_shard(relative_path, shard):
+                    continue
+                # If the file is markdown, queue it to be converted to HTML with its module tags replaced
+                page_args = {
+                    'input_path': input_path,
+                    'file_path': file_path,
+                    'output_file_': output_file,
+                    'root': root,
+                    'urlroot': urlroot,
+                    'favicon': favicon,
+                    'website_title': website_title,
+                    'template_path': template_path,
+                    'output_path': output_path,
+                }
+                page_count = 1
+                if contains_marker(file_path, b':page='):
+                    # Every page of paginated previews is an output of its own, counted from the front matter of the listed posts
+                    page_count = count_preview_pages(read_file_content(file_path), root, convert_to_html)
+                for page_number in range(1, page_count + 1):
+                    output_file_relpath = os.path.relpath(get_paginated_output_path(get_html_output_path(output_file), page_number), output_path)
+                    queued_pages.append((len(pages), output_file_relpath, dict(page_args, page_number=page_number) if page_number > 1 else page_args))
+                    pages.append(None)
 
             else:
                 # For non-md and non-html files, copy them as is to the output directory
-                shutil.copy2(file_path, output_file)
+                if not is_html:
+                    static_files.append((file_path, relative_path))
+                if not is_in_shard(relative_path, shard):
+                    # Still fingerprinted and measured above, since pages of this shard may link to it
+                    continue
+                if manifest and manifest.is_fresh(relative_path, output_path):
+                    manifest.keep(relative_path)
+                    if is_html:
+                        pages.append(content_spool.spool(manifest.get_page(relative_path)))
+                    continue
+                assets.append((file_path, output_file))
+                page = None
+                if is_html:
+                    # Plain html files are published as they are, so they are listed in the sitemap and feed too
+                    page = extract_page_record(read_file_content(file_path))
+                    # Copies keep the source's mtime
+                    page.update({'source': relative_path, 'path': relative_path, 'url': get_page_url(relative_path, urlroot), 'mtime': get_source_time(file_path)})
+                    pages.append(content_spool.spool(page))
+                if manifest:
+                    manifest.record(relative_path, relative_path, [f'source:{relative_path}'], page)
+
+    if tag_pages:
+        from generateRSS import get_feed_slug
+        queued_relpaths = {output_file_relpath for _, output_file_relpath, _ in queued_pages}
+        # Tags differing only by case share a page, titled as the newest post spells the tag
+        site_tags = {}
+        for tag, date in sorted(get_site_tags(input_path, convert_to_html).items()):
+            slug = get_feed_slug(tag)
+            site_tags[slug] = max(site_tags.get(slug, (date, tag)), (date, tag))
+        for slug, (date, tag) in sorted(site_tags.items()):
+            tag_file = os.path.join(input_path, 'tags', f'{slug}.md')
+            output_file = os.path.join(output_path, 'tags', f'{slug}.md')
+            output_file_relpath = os.path.relpath(get_html_output_path(output_file), output_path)
+            if output_file_relpath in queued_relpaths or not is_in_shard(os.path.relpath(tag_file, input_path), shard):
+                # A page of the input takes precedence
+                continue
+            queued_pages.append((len(pages), output_file_relpath, {
+                'input_path': input_path,
+                'file_path': tag_file,
+                'output_file_': output_file,
+                'root': os.path.dirname(tag_file),
+                'urlroot': urlroot,
+                'favicon': favicon,
+                'website_title': website_title,
+                'template_path': template_path,
+                'output_path': output_path,
+                'content': get_tag_page_content(tag, date),
+            }))
+            queued_relpaths.add(output_file_relpath)
+            pages.append(None)
+
+    source_hashes = {}
+
+    def get_source_hash(file_path):
+        if file_path not in source_hashes:
+            source_hashes[file_path] = manifest.file_hash(file_path) if manifest else hash_file(file_path)
+        return source_hashes[file_path]
+
+    image_map = {}
+    responsive_images = None
+    if BUILD_OPTIONS['images']:
+        # Resized derivatives of the images, offered to browsers through srcset
+        with timings.stage('images'):
+            from responsiveImages import ResponsiveImages, is_image
+            responsive_images = ResponsiveImages(BUILD_OPTIONS['cache_dir'], **BUILD_OPTIONS['images'])
+            images = [(file_path, relative_path.replace(os.sep, '/'), get_source_hash(file_path)) for file_path, relative_path in static_files if is_image(file_path)]
+            image_map, derivatives = responsive_images.build(images, output_path, is_published=lambda relpath: is_in_shard(relpath, shard))
+            for cached_file, output_file, source_relpath, derivative_relpath in derivatives:
+                if cached_file != output_file:
+                    assets.append((cached_file, output_file))
+                if manifest:
+                    manifest.record(derivative_relpath, source_relpath, [f'source:{source_relpath}'])
+
+    asset_map = {}
+    if BUILD_OPTIONS['optimize']:
+        # Pages link to content hashed copies of the stylesheets and static files, which can be cached forever
+        with timings.stage('fingerprint'):
+            asset_map['static/css/theme.css'] = write_fingerprinted_css(css, output_path, 'static/css/theme.css')
+            if BUILD_OPTIONS['highlight_classes']:
+                asset_map['static/css/highlight.css'] = write_fingerprinted_css(os.path.join(output_path, highlight_css_relpath), output_path, 'static/css/highlight.css')
+            for file_path, relative_path in static_files:
+                relpath = relative_path.replace(os.sep, '/')
+                asset_map[relpath] = fingerprint_path(relpath, get_source_hash(file_path))
+                if is_in_shard(relpath, shard):
+                    assets.append((file_path, os.path.join(output_path, asset_map[relpath])))
+        if manifest:
+            for relpath, fingerprinted_relpath in asset_map.items():
+                source_dependency = {'static/css/theme.css': 'css', 'static/css/highlight.css': 'config'}.get(relpath, f'source:{relpath}')
+                # Stylesheets are written by every shard
+                if source_dependency in ('css', 'config') or is_in_shard(relpath, shard):
+                    manifest.record(fingerprinted_relpath, relpath, [source_dependency])
+
+    if manifest and (asset_map or image_map):
+        manifest.set_asset_map({'assets': asset_map, 'images': image_map})
+        page_dependencies.append('assets')
+
+    with timings.stage('copy'):
+        _, _, copied_bytes = copy_assets(assets, BUILD_OPTIONS['copy_mode'])
+        timings.add_bytes(read=copied_bytes, written=copied_bytes)
+
+    pages_args = []
+    pending_slots = []
+    for slot, output_file_relpath, page_args in queued_pages:
+        if manifest and manifest.is_fresh(output_file_relpath, output_path):
+            manifest.keep(output_file_relpath)
+            pages[slot] = content_spool.spool(manifest.get_page(output_file_relpath))
+            continue
+        pending_slots.append(slot)
+        pages_args.append(page_args)
+
+    # Rendered pages stream out of render_pages, and only their records, contents spooled, stay in memory
+    for slot, page in zip(pending_slots, render_pages(pages_args, module_dict, jobs, asset_map, image_map, responsive_images)):
+        pages[slot] = content_spool.spool(page)
+        if manifest:
+            manifest.record(page['path'], page['source'], [f"source:{page['source']}"] + page_dependencies + page['dependencies'], page)
+
+    if manifest:
+        manifest.remove_stale(output_path)
+        manifest.save()
+
+    if pages_args:
+        # Only conversions add to the highlight cache
+        get_build_highlight_cache().prune()
+
+    return pages
+
+def add_site_index_arguments(parser):
+    """Adds the options of the files built from every page of the site, which `merge` takes too."""
+    parser.add_argument('--root', help="Project url root", required=False, default='')
+    parser.add_argument('--title', help="Website title", required=False, default='')
+    parser.add_argument('--rss-whitelist', default='*', help='Comma-separated list of URI patterns to include in the feed (supports wildcards).')
+    parser.add_argument('--rss-description', default='This is an RSS feed of my website.', help='Description of the RSS feed.')
+    parser.add_argument('--rss-limit', type=int, default=None, help="Only include the newest N items in each feed")
+    parser.add_argument('--rss-content', choices=['full', 'summary'], default='full', help="Include the full page content in feed items, or only the page description")
+    parser.add_argument('--rss-per-tag', action='store_true', help="Also write a feed per tag under tags/<tag>/rss.xml")
+    parser.add_argument('--rss-per-directory', action='store_true', help="Also write a feed per top level directory under <directory>/rss.xml")
+    parser.add_argument('--sitemap-gzip', action='store_true', help="Gzip the sitemap files")
+    parser.add_argument('--search', action='store_true', help="Write a sharded search index of the pages under search/ and a search box loading it in the browser")
+    parser.add_argument('--reproducible', action='store_true', help="Write byte-stable output, dating sources without a date meta entry with times pinned across builds, and a deploy manifest (.simplymarkdown-deploy.json) of the files added, modified and deleted since the previous build")
+    parser.add_argument('--previous-deploy', default=None, metavar='JSON_FILE', help="Deploy manifest of the previous build, e.g. from the deployed site (default: the one in the output directory)")
+
+def write_deploy_manifest(deploy_manifest):
+    with timings.stage('deploy_manifest'):
+        added, modified, deleted = deploy_manifest.write()
+    print(f'Deploy manifest: {added} added, {modified} modified, {deleted} deleted')
+
+def write_site_indexes(args, pages):
+    """Writes the sitemap, RSS feeds and search index of the site from its page records."""
+    from generateSitemap import generate_sitemap
+    from generateRSS import generate_rss_feed
+    with timings.stage('sitemap'):
+        generate_sitemap(args.output, args.root, pages, args.sitemap_gzip)
+    with timings.stage('rss'):
+        generate_rss_feed(args.output, args.root, args.rss_whitelist, args.title, args.rss_description, pages,
+                          args.rss_limit, args.rss_content == 'full', args.rss_per_tag, args.rss_per_directory)
+    if args.search:
+        with timings.stage('search'):
+            generate_search_index(args.output, args.root, pages, args.cache_dir, args.title)
+
+def merge(argv):
+    """`render.py merge`: writes the site wide files of a build split with --shard, once every shard's output is gathered in one directory."""
+    parser = argparse.ArgumentParser(prog='render.py merge', description="Write the sitemap, RSS feeds and search index of a sharded build from the page records every shard wrote.")
+    parser.add_argument('-o', '--output', help="Output directory the outputs of every shard were gathered into", required=True)
+    add_site_index_arguments(parser)
+    parser.add_argument('--cache-dir', default='.simplymarkdown-cache', help="Directory for caches kept between builds, such as the terms of the search index")
+    parser.add_argument('--optimize', action='store_true', help="Write precompressed .gz (and .br with brotli installed) siblings of the merged files")
+    args = parser.parse_args(argv)
+
+    try:
+        pages, sources = read_shard_records(args.output)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.reproducible and sources is None:
+        parser.error('--reproducible needs shards built with --reproducible')
+    write_site_indexes(args, pages)
+    if args.optimize:
+        compress_output(args.output)
+    if args.reproducible:
+        deploy_manifest = DeployManifest(args.output, args.previous_deploy)
+        deploy_manifest.sources = sources
+        write_deploy_manifest(deploy_manifest)
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ['merge']:
+        merge(sys.argv[2:])
+        sys.exit()
+
     # Argument parsing
-    parser = argparse.ArgumentParser(description="Process files in input directory.")
+    parser = argparse.ArgumentParser(description="Process files in input directory. Run `render.py merge --help` for combining sharded builds.")
     parser.add_argument('-i', '--input', help="Input directory path", required=True)
     parser.add_argument('-o', '--output', help="Output directory path", required=True)
     parser.add_argument('--css', help="CSS to include", required=False, default='themes/basic.css')
     parser.add_argument('--template', help="Path to the HTML template", required=False, default='templates/base.html')
     parser.add_argument('--favicon', help="Favicon emoji", required=False, default='👤')
-    parser.add_argument('--root', help="Project url root", required=False, default='')
-    parser.add_argument('--title', help="Website title", required=False, default='')
-    parser.add_argument('--rss-whitelist', default='*', help='Comma-separated list of URI patterns to include in the feed (supports wildcards).')
-    parser.add_argument('--rss-description', default='This is an RSS feed of my website.', help='Description of the RSS feed.')
+    add_site_index_arguments(parser)
+    parser.add_argument('--tag-pages', action='store_true', help="Generate an index page for every tag under tags/<tag>.html, listing the site's posts with that tag")
+    parser.add_argument('--incremental', action='store_true', help="Only rebuild outputs whose sources, modules, template, CSS or previewed posts changed")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Number of processes rendering pages in parallel, 0 uses every core")
+    parser.add_argument('--shard', type=parse_shard, default=None, metavar='I/N', help="Only build the pages and files of shard I of N, split by a hash of their paths, and write their records for `render.py merge` instead of the sitemap, feeds and search index")
+    parser.add_argument('--watch', action='store_true', help="Serve the output locally and rebuild affected pages whenever the input, template or CSS changes")
+    parser.add_argument('--port', type=int, default=8000, help="Port of the local server used by --watch")
+    parser.add_argument('--cache-dir', default='.simplymarkdown-cache', help="Directory for caches kept between builds, such as compiled templates")
+    parser.add_argument('--highlight-classes', action='store_true', help="Highlight code with css classes and a shared static/css/highlight.css instead of inline styles")
+    parser.add_argument('--highlight-cache-size', type=int, default=128, help="Maximum size of the on-disk code highlighting cache in megabytes")
+    parser.add_argument('--copy-mode', choices=['copy', 'hardlink', 'reflink'], default='copy', help="How static files reach the output: copies, hardlinks to the inputs, or copy-on-write clones where the filesystem supports them")
+    parser.add_argument('--optimize', action='store_true', help="Link content hashed copies of the CSS and static files, minify html and CSS, and write precompressed .gz (and .br with brotli installed) siblings")
+    parser.add_argument('--responsive-images', action='store_true', help="Publish resized derivatives of jpeg, png and webp images and give <img> tags srcset, sizes, width, height and loading=lazy (requires Pillow)")
+    parser.add_argument('--image-widths', default='480,960,1600', help="Comma-separated widths of the resized images")
+    parser.add_argument('--image-formats', default='webp', help="Comma-separated extra formats offered through <picture>, besides each image's own format")
+    parser.add_argument('--image-quality', type=int, default=80, help="Encoding quality of the resized images")
+    parser.add_argument('--image-sizes', default='(max-width: 960px) 100vw, 960px', help="The sizes attribute given to responsive images")
+    parser.add_argument('--timings', nargs='?', const='build-timings.json', default=None, metavar='JSON_FILE', help="Print per stage and per page timings and write them to a JSON file (default: build-timings.json)")
+    parser.add_argument('--slowest', type=int, default=10, help="Number of slowest pages listed by --timings")
+    parser.add_argument('--profile', nargs='?', const='build.prof', default=None, metavar='PROF_FILE', help="Write a cProfile dump of the build, readable with pstats or snakeviz (default: build.prof). Only covers the main process, use with -j 1")
     args = parser.parse_args()
+    if args.shard and args.watch:
+        parser.error('--watch builds the whole site, it cannot be combined with --shard')
+
+    images = None
+    if args.responsive_images:
+        from responsiveImages import is_available as is_responsive_images_available, get_supported_formats
+        if is_responsive_images_available():
+            images = {
+                'widths': [int(width) for width in args.image_widths.split(',')],
+                'formats': [image_format.strip().lower() for image_format in args.image_formats.split(',') if image_format.strip()],
+                'quality': args.image_quality,
+                'sizes': args.image_sizes,
+            }
+            # Checked up front, since an unsupported format would only fail once images are resized
+            supported_formats = get_supported_formats()
+            unsupported_formats = [image_format for image_format in images['formats'] if image_format not in supported_formats]
+            if unsupported_formats:
+                parser.error(f"--image-formats: cannot write {', '.join(unsupported_formats)} images, supported formats are {', '.join(supported_formats)}")
+        else:
+            print('--responsive-images needs Pillow (pip install Pillow), images are published as they are')
+
+    from siteBuilder import Site
+    site = Site(args.input, args.output, css=args.css, template=args.template, favicon=args.favicon, root=args.root, title=args.title,
+                rss_whitelist=args.rss_whitelist, rss_description=args.rss_description, rss_limit=args.rss_limit, rss_content=args.rss_content,
+                rss_per_tag=args.rss_per_tag, rss_per_directory=args.rss_per_directory, sitemap_gzip=args.sitemap_gzip, search=args.search,
+                tag_pages=args.tag_pages, incremental=args.incremental or args.watch, jobs=args.jobs, shard=args.shard, cache_dir=args.cache_dir,
+                highlight_classes=args.highlight_classes, highlight_cache_size=args.highlight_cache_size, copy_mode=args.copy_mode,
+                optimize=args.optimize, images=images, reproducible=args.reproducible, previous_deploy=args.previous_deploy,
+                timings=args.timings, slowest=args.slowest)
+
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.runcall(site.build)
+        profiler.dump_stats(args.profile)
+    else:
+        site.build()
 
-    process_directory(args.input, args.output, args.css, args.template, args.favicon, args.root, args.title)
-    generate_sitemap(args.output, args.root)
-    generate_rss_feed(args.output, args.root, args.rss_whitelist, args.title, args.rss_description)
+    if args.watch:
+        from devServer import watch
+        # Rebuild incrementally in this warm process; the manifest limits each rebuild to affected pages
+        watch([args.input, os.path.dirname(os.path.abspath(args.template)), args.css], site.build, args.output, args.port)
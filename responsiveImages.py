@@ -0,0 +1,159 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from pageRecords import format_starttag
+
+try:
+    import PIL
+    from PIL import Image, ImageOps
+except ImportError:
+    # Responsive images need Pillow; without it images are published as they are
+    Image = None
+
+IMAGE_FORMATS = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.webp': 'webp'}
+FORMAT_EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp', 'avif': '.avif'}
+DEFAULT_WIDTHS = (480, 960, 1600)
+DEFAULT_FORMATS = ('webp',)
+DEFAULT_SIZES = '(max-width: 960px) 100vw, 960px'
+DEFAULT_QUALITY = 80
+# Width of the derivative used for og:image and twitter:image
+OG_IMAGE_WIDTH = 1200
+EXIF_ORIENTATION = 0x0112
+
+def is_available():
+    return Image is not None
+
+def get_supported_formats():
+    """Returns the formats derivatives can be written in with the installed Pillow."""
+    # Pillow registers the formats it can save once its plugins are loaded
+    Image.init()
+    return [image_format for image_format in FORMAT_EXTENSIONS if image_format.upper() in Image.SAVE]
+
+def is_image(file_name):
+    return os.path.splitext(file_name)[1].lower() in IMAGE_FORMATS
+
+def read_dimensions(file_path):
+    """Returns an image's displayed width and height, reading only its header."""
+    with Image.open(file_path) as image:
+        width, height = image.size
+        # Orientations 5 to 8 are rotated by 90 degrees
+        if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+    return width, height
+
+def derivative_key(source_hash, width, image_format, quality):
+    payload = json.dumps([PIL.__version__, source_hash, width, image_format, quality])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def render_derivative(source, destination, width, image_format, quality):
+    """Writes a resized copy of an image in the given format."""
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temporary_path = f'{destination}.{os.getpid()}.tmp'
+        image.save(temporary_path, format=image_format.upper(), quality=quality, optimize=True)
+    os.replace(temporary_path, destination)
+
+class ResponsiveImages:
+    """Plans and produces resized derivatives of the images of a site.
+
+    Derivatives are named after a hash of their source's content and of their width,
+    format and quality, and kept in a cache directory, so each one is produced once and
+    then only copied to the output. Every image gets derivatives in its own format (used
+    by the `<img>` fallback) and in each extra format (offered through `<source>`, with a
+    full size copy), at every configured width smaller than the image.
+    """
+
+    def __init__(self, cache_dir=None, widths=DEFAULT_WIDTHS, formats=DEFAULT_FORMATS, quality=DEFAULT_QUALITY, sizes=DEFAULT_SIZES):
+        self.cache_dir = os.path.join(cache_dir, 'images') if cache_dir else None
+        self.widths = sorted(set(widths))
+        self.formats = list(formats)
+        self.quality = quality
+        self.sizes = sizes
+
+    def plan(self, relpath, source_hash, dimensions):
+        """Returns the image map entry of an image and the derivatives it needs, as (relpath, width, format, key)."""
+        width, height = dimensions
+        fallback = IMAGE_FORMATS[os.path.splitext(relpath)[1].lower()]
+        base = os.path.splitext(relpath)[0]
+        derivatives = []
+        sources = {}
+        for image_format in self.formats + [fallback]:
+            if image_format in sources:
+                continue
+            sources[image_format] = []
+            # Extra formats also get a full size copy, the fallback format has the original
+            widths = [w for w in self.widths if w < width] + ([width] if image_format != fallback else [])
+            for derivative_width in widths:
+                key = derivative_key(source_hash, derivative_width, image_format, self.quality)
+                derivative_relpath = f'{base}.{derivative_width}w.{key[:10]}{FORMAT_EXTENSIONS[image_format]}'
+                derivatives.append((derivative_relpath, derivative_width, image_format, key))
+                sources[image_format].append((derivative_relpath, derivative_width))
+
+        # Images already small enough are used for social cards as they are
+        og = [derivative_relpath for derivative_relpath, derivative_width in sources[fallback] if derivative_width <= OG_IMAGE_WIDTH]
+        entry = {'width': width, 'height': height, 'fallback': fallback, 'sources': sources, 'og': og[-1] if og and width > OG_IMAGE_WIDTH else None}
+        return entry, derivatives
+
+    def cache_path(self, key, image_format):
+        return os.path.join(self.cache_dir, key[:2], key + FORMAT_EXTENSIONS[image_format])
+
+    def build(self, images, output_path, max_workers=None, is_published=None):
+        """Produces the derivatives of (file_path, relpath, source_hash) images.
+
+        Returns the image map, keyed by the images' output relpaths, and the
+        (cached file, output file, source relpath, output relpath) derivatives to publish.
+        Images for which `is_published(relpath)` is false are mapped but get no derivatives.
+        """
+        image_map = {}
+        jobs = []
+        published = []
+        for file_path, relpath, source_hash in images:
+            try:
+                dimensions = read_dimensions(file_path)
+            except (OSError, SyntaxError):
+                # Not an image Pillow can read, it is published as it is
+                continue
+            image_map[relpath], derivatives = self.plan(relpath, source_hash, dimensions)
+            if is_published and not is_published(relpath):
+                continue
+            for derivative_relpath, width, image_format, key in derivatives:
+                output_file = os.path.join(output_path, derivative_relpath)
+                target = self.cache_path(key, image_format) if self.cache_dir else output_file
+                if not os.path.exists(target):
+                    jobs.append((file_path, target, width, image_format, self.quality))
+                published.append((target, output_file, relpath, derivative_relpath))
+
+        # Pillow releases the GIL while resizing and encoding
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda job: render_derivative(*job), jobs))
+        return image_map, published
+
+    def get_markup(self, entry, attrs, self_closing, get_url):
+        """Returns the markup replacing an `<img>`: the tag with srcset, sizes and dimensions, in a `<picture>` when there are extra formats."""
+        present = {name for name, _ in attrs}
+        fallback = entry['fallback']
+        src = dict(attrs).get('src')
+
+        def srcset(image_format):
+            candidates = [f'{get_url(relpath)} {width}w' for relpath, width in entry['sources'][image_format]]
+            if image_format == fallback:
+                # The original closes the fallback srcset at its own width
+                candidates.append(f"{src} {entry['width']}w")
+            return ', '.join(candidates)
+
+        extra = [('width', str(entry['width'])), ('height', str(entry['height'])), ('loading', 'lazy'), ('decoding', 'async')]
+        if entry['sources'][fallback]:
+            extra = [('srcset', srcset(fallback)), ('sizes', self.sizes)] + extra
+        img = format_starttag('img', attrs + [(name, value) for name, value in extra if name not in present], self_closing)
+
+        source_formats = [image_format for image_format in entry['sources'] if image_format != fallback and entry['sources'][image_format]]
+        if not source_formats:
+            return img
+        sources = ''.join(format_starttag('source', [('type', f'image/{image_format}'), ('srcset', srcset(image_format)), ('sizes', self.sizes)])
+                          for image_format in source_formats)
+        return f'<picture>{sources}{img}</picture>'
@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+from html import unescape
+from outputOptimizer import write_if_changed
+from pageRecords import get_page_content, has_content, read_page_records
+
+SEARCH_DIRECTORY = 'search'
+SEARCH_INDEX_VERSION = 1
+# Terms are sharded by their first characters, so a query fetches one small shard per term
+SHARD_KEY_LENGTH = 2
+# Documents are listed in chunks, so showing results fetches the chunks of the top hits only
+DOCS_PER_CHUNK = 500
+TITLE_WEIGHT = 10
+TAG_WEIGHT = 5
+# Python's \w is [\p{L}\p{N}_], the pattern search.js tokenizes queries with, as index.json tells it
+TOKEN_RE = re.compile(r'\w+')
+TOKEN_PATTERN = r'[\p{L}\p{N}_]+'
+MIN_TERM_LENGTH = 2
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+STOP_WORDS = frozenset('an and are as at be but by for from has have in is it its of on or that the this to was were will with'.split())
+
+SEARCH_LOADER_JS = r"""(() => {
+  const base = document.currentScript.src.replace(/[^/]*$/, '');
+  const requests = {};
+  // Shards and document chunks are versioned by content hash, the index itself is always revalidated
+  const load = (path, version) => requests[path] ||= fetch(version ? `${base}${path}?v=${version}` : base + path, version ? {} : { cache: 'no-cache' }).then((response) => response.json());
+  // Queries are tokenized like the pages were, by the rules index.json carries
+  const tokenize = (text, index) => (text.toLowerCase().match(new RegExp(index.tokenPattern, 'gu')) || [])
+    .filter((term) => [...term].length >= index.minLength && !index.stopWords.includes(term));
+  const hex = (text) => Array.from(new TextEncoder().encode(text), (byte) => byte.toString(16).padStart(2, '0')).join('');
+
+  async function search(query, limit = 20) {
+    const index = await load('index.json');
+    const terms = tokenize(query, index);
+    let scores = null;
+    for (const [position, term] of terms.entries()) {
+      const key = [...term].slice(0, index.keyLength).join('');
+      const shard = key in index.shards ? await load(`shards/${hex(key)}.json`, index.shards[key]) : {};
+      const termScores = new Map();
+      for (const [indexed, postings] of Object.entries(shard)) {
+        // The last term is matched as a prefix, so results follow typing
+        if (indexed === term || (position === terms.length - 1 && indexed.startsWith(term))) {
+          for (let i = 0, id = 0; i < postings.length; i += 2) {
+            id += postings[i];
+            termScores.set(id, (termScores.get(id) || 0) + postings[i + 1]);
+          }
+        }
+      }
+      // Terms no page has, typos among them, narrow nothing down
+      if (termScores.size === 0) continue;
+      scores = scores === null ? termScores : new Map([...scores].filter(([id]) => termScores.has(id)).map(([id, score]) => [id, score + termScores.get(id)]));
+    }
+    const hits = [...(scores || [])].sort((a, b) => b[1] - a[1]).slice(0, limit);
+    return Promise.all(hits.map(async ([id, score]) => {
+      const chunk = Math.floor(id / index.chunk);
+      const [url, title, date, tags] = (await load(`docs/${chunk}.json`, index.docs[chunk]))[id % index.chunk];
+      return { url, title, date, tags, score };
+    }));
+  }
+
+  window.simplySearch = search;
+  for (const input of document.querySelectorAll('input[data-search]')) {
+    const results = document.querySelector(input.dataset.search);
+    input.addEventListener('input', async () => {
+      const query = input.value;
+      const hits = await search(query);
+      if (input.value !== query) return;
+      results.replaceChildren(...hits.map(({ url, title, date }) => {
+        const item = document.createElement('li');
+        const link = document.createElement('a');
+        // Urls are relative to the site root when the site is built without --root
+        link.href = new URL(url, new URL('..', base));
+        link.textContent = title;
+        item.append(link, date ? ` ${date}` : '');
+        return item;
+      }));
+    });
+  }
+})();
+"""
+
+def tokenize(text):
+    return [term for term in TOKEN_RE.findall(text.lower()) if len(term) >= MIN_TERM_LENGTH and term not in STOP_WORDS]
+
+def get_page_title(page, site_title=''):
+    """Returns a page's title without the ` - <site title>` suffix pages are rendered with."""
+    title = page['title'] or page['url']
+    suffix = f' - {site_title}'
+    return title[:-len(suffix)] if site_title and title.endswith(suffix) else title
+
+def get_term_weights(page, content, site_title=''):
+    """Weighs the terms of a page by their occurrences, counting title and tag terms more."""
+    weights = {}
+    for text, weight in ((unescape(HTML_TAG_RE.sub(' ', content or '')), 1), (get_page_title(page, site_title), TITLE_WEIGHT), (' '.join(page['tags']), TAG_WEIGHT)):
+        for term in tokenize(text):
+            weights[term] = weights.get(term, 0) + weight
+    return weights
+
+def get_content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+def encode_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+def write_json_files(directory, files):
+    """Writes `<name>.json` files, removing the other files of the directory and their precompressed siblings.
+
+    Returns the content hash of every file and the number of files written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    hashes = {}
+    written = 0
+    for name, value in files.items():
+        data = encode_json(value)
+        hashes[name] = get_content_hash(data)
+        written += write_if_changed(os.path.join(directory, f'{name}.json'), data)
+    for file in os.listdir(directory):
+        if file.partition('.')[0] not in files:
+            os.remove(os.path.join(directory, file))
+    return hashes, written
+
+class SearchIndex:
+    """Sharded inverted index of a site's pages, searched in the browser by search.js.
+
+    Written under `search/`:
+
+    - `index.json`: the content hash of every shard and document chunk, and the tokenizer rules queries follow
+    - `shards/<hex of key>.json`: the postings of the terms starting with `key`, as
+      `{term: [id delta, weight, ...]}`
+    - `docs/<n>.json`: `[url, title, date, tags]` of documents `n * chunk` onwards
+    - `search.js`: the loader, exposing `simplySearch(query)` and binding `input[data-search]`
+
+    With a cache directory, the terms of every page are kept along with a hash of its content
+    and the size and mtime of its output file, so later builds only tokenize pages that
+    changed. Pages keep their document id between builds, so adding a page rewrites only its
+    chunk and the shards of its terms.
+    """
+
+    def __init__(self, root_directory, cache_dir=None, site_title=''):
+        self.root_directory = root_directory
+        self.cache_file = os.path.join(cache_dir, 'search-documents.json') if cache_dir else None
+        self.site_title = site_title
+        self.documents = {}
+        self.load()
+
+    def load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        with open(self.cache_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == SEARCH_INDEX_VERSION and data.get('root') == os.path.abspath(self.root_directory):
+            self.documents = data['documents']
+
+    def save(self):
+        if not self.cache_file:
+            return
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': SEARCH_INDEX_VERSION, 'root': os.path.abspath(self.root_directory), 'documents': self.documents}, f, ensure_ascii=False)
+
+    def update(self, pages):
+        """Brings the documents up to date with the site's page records, returning how many were tokenized."""
+        documents = {}
+        tokenized = 0
+        used_ids = set()
+        for page in pages:
+            stat = os.stat(os.path.join(self.root_directory, page['path']))
+            stat = [stat.st_size, stat.st_mtime_ns]
+            document = self.documents.get(page['path'])
+            doc = [page['url'], get_page_title(page, self.site_title), page['date'], page['tags']]
+            # Pages rendered in this build carry their content, pages kept from the last one are read back only if their file changed
+            digest = hashlib.sha256(json.dumps([get_page_content(page, self.root_directory), doc]).encode('utf-8')).hexdigest() if has_content(page) else None
+            if document is None or (document['hash'] != digest if digest else document['stat'] != stat):
+                content = get_page_content(page, self.root_directory)
+                digest = digest or hashlib.sha256(json.dumps([content, doc]).encode('utf-8')).hexdigest()
+                document = {'id': document['id'] if document else None, 'hash': digest, 'doc': doc, 'terms': get_term_weights(page, content, self.site_title)}
+                tokenized += 1
+            document['stat'] = stat
+            documents[page['path']] = document
+            if document['id'] is not None:
+                used_ids.add(document['id'])
+
+        # New pages take the lowest free ids, so ids stay dense as pages come and go
+        free_ids = (document_id for document_id in range(len(documents)) if document_id not in used_ids)
+        for document in documents.values():
+            if document['id'] is None or document['id'] >= len(documents):
+                document['id'] = next(free_ids)
+        self.documents = documents
+        return tokenized
+
+    def write(self):
+        """Writes the index files, leaving unchanged shards and chunks untouched. Returns the number of files written."""
+        search_path = os.path.join(self.root_directory, SEARCH_DIRECTORY)
+        chunks = {}
+        postings = {}
+        for document in sorted(self.documents.values(), key=lambda document: document['id']):
+            chunk = chunks.setdefault(document['id'] // DOCS_PER_CHUNK, [None] * DOCS_PER_CHUNK)
+            chunk[document['id'] % DOCS_PER_CHUNK] = document['doc']
+            for term, weight in document['terms'].items():
+                postings.setdefault(term, []).append((document['id'], weight))
+
+        shards = {}
+        for term in sorted(postings):
+            encoded = []
+            previous_id = 0
+            # Documents were visited in id order, so ids are stored as deltas
+            for document_id, weight in postings[term]:
+                encoded += [document_id - previous_id, weight]
+                previous_id = document_id
+            shards.setdefault(term[:SHARD_KEY_LENGTH], {})[term] = encoded
+
+        shard_hashes, shards_written = write_json_files(os.path.join(search_path, 'shards'), {key.encode('utf-8').hex(): shard for key, shard in shards.items()})
+        chunk_hashes, chunks_written = write_json_files(os.path.join(search_path, 'docs'), {str(number): chunk for number, chunk in chunks.items()})
+        index = {
+            'version': SEARCH_INDEX_VERSION,
+            'keyLength': SHARD_KEY_LENGTH,
+            'chunk': DOCS_PER_CHUNK,
+            'shards': {key: shard_hashes[key.encode('utf-8').hex()] for key in shards},
+            'docs': chunk_hashes,
+            'tokenPattern': TOKEN_PATTERN,
+            'minLength': MIN_TERM_LENGTH,
+            'stopWords': sorted(STOP_WORDS),
+        }
+        written = shards_written + chunks_written
+        written += write_if_changed(os.path.join(search_path, 'index.json'), encode_json(index))
+        written += write_if_changed(os.path.join(search_path, 'search.js'), SEARCH_LOADER_JS.encode('utf-8'))
+        return written
+
+def generate_search_index(root_directory, urlroot='', pages=None, cache_dir=None, site_title=''):
+    """Writes the search index of the html pages of a directory.
+
+    `pages` are page records (see pageRecords.extract_page_record); without them the
+    output directory is scanned.
+    """
+    if pages is None:
+        pages = read_page_records(root_directory, urlroot)
+    search_index = SearchIndex(root_directory, cache_dir, site_title)
+    search_index.update(pages)
+    search_index.write()
+    search_index.save()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a sharded client-side search index for a directory of HTML files.')
+    parser.add_argument('root_directory', help='Root directory of the built site')
+    parser.add_argument('--urlroot', default='', help='URL root of the website')
+    parser.add_argument('--cache-dir', default=None, help='Directory keeping the terms of every page between runs')
+    parser.add_argument('--title', default='', help='Website title, stripped from page titles')
+    args = parser.parse_args()
+
+    generate_search_index(args.root_directory, args.urlroot, None, args.cache_dir, args.title)
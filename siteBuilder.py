@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import hashlib
+
+from buildManifest import BuildManifest, MANIFEST_FILE_NAME
+from buildShards import get_shard_manifest_name, write_shard_records
+from buildTimings import timings
+from deployManifest import DeployManifest, get_source_date_epoch
+from outputOptimizer import compress_output
+from pageRecords import content_spool
+from helpers import configure
+from render import process_directory, write_site_indexes, write_deploy_manifest
+
+class Site:
+    """A site and the options it is built with, for building from Python instead of the command line.
+
+    Options are named after the long options of render.py:
+
+        site = Site('site', 'public', root='https://myblog.com', title='My blog', search=True)
+        pages = site.build()
+
+    `images` holds the widths, formats, quality and sizes of responsive images, None
+    disables them. Markdown converters, compiled templates, preview items and, with
+    `incremental`, the build manifest are kept between build() calls, so later builds in
+    the same process only pay for what changed. The sitemap, feeds and search index are
+    only written again when the page records or contents they are built from changed.
+    markdown, pygments and jinja2 are only imported once a page is converted, and Pillow
+    once images are resized.
+    """
+
+    def __init__(self, input, output, css='themes/basic.css', template='templates/base.html', favicon='👤', root='', title='',
+                 rss_whitelist='*', rss_description='This is an RSS feed of my website.', rss_limit=None, rss_content='full', rss_per_tag=False, rss_per_directory=False,
+                 sitemap_gzip=False, search=False, tag_pages=False, incremental=False, jobs=1, shard=None, cache_dir='.simplymarkdown-cache',
+                 highlight_classes=False, highlight_cache_size=128, copy_mode='copy', optimize=False, images=None,
+                 reproducible=False, previous_deploy=None, timings=None, slowest=10):
+        self.input = input
+        self.output = output
+        self.css = css
+        self.template = template
+        self.favicon = favicon
+        self.root = root
+        self.title = title
+        self.rss_whitelist = rss_whitelist
+        self.rss_description = rss_description
+        self.rss_limit = rss_limit
+        self.rss_content = rss_content
+        self.rss_per_tag = rss_per_tag
+        self.rss_per_directory = rss_per_directory
+        self.sitemap_gzip = sitemap_gzip
+        self.search = search
+        self.tag_pages = tag_pages
+        self.jobs = jobs or os.cpu_count() or 1
+        self.shard = shard
+        self.cache_dir = cache_dir
+        self.highlight_classes = highlight_classes
+        self.highlight_cache_size = highlight_cache_size
+        self.copy_mode = copy_mode
+        self.optimize = optimize
+        self.images = images
+        self.reproducible = reproducible
+        self.previous_deploy = previous_deploy
+        # JSON file the timings of every build are written to, None disables timings
+        self.timings = timings
+        self.slowest = slowest
+
+        # Hash of what the site wide files were last written from, see get_site_index_hash()
+        self.site_index_hash = None
+        self.manifest = None
+        if incremental:
+            config = {'root': root, 'title': title, 'favicon': favicon, 'highlight_classes': highlight_classes, 'optimize': optimize, 'images': images, 'search': search, 'reproducible': reproducible}
+            manifest_name = get_shard_manifest_name(MANIFEST_FILE_NAME, shard) if shard else MANIFEST_FILE_NAME
+            self.manifest = BuildManifest(os.path.join(output, manifest_name), input, template, css, config)
+
+    def configure(self):
+        """Sets the build wide options to this site's; another Site may have been built in between."""
+        configure(cache_dir=self.cache_dir, highlight_classes=self.highlight_classes, highlight_cache_bytes=self.highlight_cache_size * 1024 * 1024,
+                  timings=self.timings is not None, copy_mode=self.copy_mode, optimize=self.optimize, images=self.images, search=self.search,
+                  reproducible=self.reproducible, source_times=None)
+
+    def get_site_index_hash(self, pages):
+        """Hashes the options and page records the sitemap, feeds and search index are written from.
+
+        Contents are compared by the digests content_spool took as they were spooled, so none is read back.
+        """
+        options = [self.root, self.title, self.rss_whitelist, self.rss_description, self.rss_limit, self.rss_content, self.rss_per_tag,
+                   self.rss_per_directory, self.sitemap_gzip, self.search, self.cache_dir]
+        digest = hashlib.sha256(json.dumps(options).encode('utf-8'))
+        for page in pages:
+            record = {key: value for key, value in page.items() if key not in ('content', 'spooled', 'dependencies')}
+            digest.update(json.dumps(record, sort_keys=True).encode('utf-8'))
+            if 'spooled' in page:
+                digest.update(content_spool.get_digest(*page['spooled']))
+            elif page.get('content') is not None:
+                digest.update(page['content'].encode('utf-8'))
+            # Separates the pages, so contents cannot run into the next record
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def build(self):
+        """Builds the site, returning a record for every published html page (see render.process_directory).
+
+        Page contents are spooled, read them with pageRecords.get_page_content() before the next build.
+        """
+        self.configure()
+        timings.reset()
+        start = time.perf_counter()
+        deploy_manifest = None
+        if self.reproducible:
+            deploy_manifest = DeployManifest(self.output, self.previous_deploy)
+            with timings.stage('pin_source_times'):
+                file_hash = self.manifest.file_hash if self.manifest else None
+                configure(source_times=deploy_manifest.pin_source_times(self.input, get_source_date_epoch(), file_hash))
+        pages = process_directory(self.input, self.output, self.css, self.template, self.favicon, self.root, self.title, self.manifest, self.jobs, self.tag_pages, self.shard)
+        if self.shard:
+            # The site wide files need every shard's pages, `render.py merge` writes them
+            with timings.stage('shard_records'):
+                write_shard_records(self.output, self.shard, pages, deploy_manifest.sources if deploy_manifest else None)
+        else:
+            # Incremental sites, rebuilt by --watch, skip the files of an unchanged site unless something removed them
+            site_index_hash = self.get_site_index_hash(pages) if self.manifest else None
+            if site_index_hash is None or site_index_hash != self.site_index_hash or not os.path.exists(os.path.join(self.output, 'rss.xml')):
+                write_site_indexes(self, pages)
+                self.site_index_hash = site_index_hash
+        if self.optimize:
+            with timings.stage('compress'):
+                compress_output(self.output)
+        if deploy_manifest and not self.shard:
+            write_deploy_manifest(deploy_manifest)
+        if timings.enabled:
+            total_seconds = time.perf_counter() - start
+            print(timings.format_table(total_seconds, self.slowest))
+            timings.write_json(self.timings, total_seconds, self.slowest)
+        return pages